@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# benchmark.py - A benchmark suite for the UsbDl and Bmo transfer paths.
+# Copyright (C) 2019-2021  Forest Crossman <cyrozap@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import argparse
+import contextlib
+import fnmatch
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import bmo_sim
+import brom_sim
+from bmo import Bmo
+from transport import open_transport
+from usbdl import UsbDl, auto_int
+
+
+class CountingTransport:
+    '''Wraps a transport and counts the reads and writes that go through it.'''
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.writes = 0
+        self.reads = 0
+
+    def close(self):
+        self.transport.close()
+
+    def write(self, data):
+        self.writes += 1
+        return self.transport.write(data)
+
+    def read(self, count):
+        self.reads += 1
+        return self.transport.read(count)
+
+    def readinto(self, buf):
+        self.reads += 1
+        return self.transport.readinto(buf)
+
+
+def usbdl_pieces(dev, size):
+    '''Split a transfer into pieces that fit in L2 SRAM, so workloads larger
+    than it reuse the same scratch space instead of touching anything else.
+    '''
+    (base, region_size) = dev.soc['l2_sram']
+    return [(base, min(region_size, size - offset)) for offset in range(0, size, region_size)]
+
+def usbdl_poke(dev):
+    dev.cmd_write32(dev.soc['l2_sram'][0], [0x12345678])
+    return 4
+
+def usbdl_peek(dev):
+    dev.cmd_read32(dev.soc['l2_sram'][0], 1)
+    return 4
+
+def usbdl_read(size):
+    def workload(dev):
+        return sum(len(dev.memory_read(addr, count)) for (addr, count) in usbdl_pieces(dev, size))
+    return workload
+
+def usbdl_write(size):
+    data = bytes(size)
+    def workload(dev):
+        for (addr, count) in usbdl_pieces(dev, size):
+            dev.memory_write(addr, data[:count])
+        return size
+    return workload
+
+def usbdl_send_da(size):
+    data = os.urandom(size)
+    def workload(dev):
+        dev.cmd_send_da(dev.soc['l2_sram'][0], data)
+        return size
+    return workload
+
+def usbdl_cqdma_read(size):
+    def workload(dev):
+        if not dev.soc.get('cqdma_base'):
+            return None
+        return len(dev.memory_read(dev.soc['sram'][0], size, cqdma=True))
+    return workload
+
+def bmo_read(size, fast):
+    def workload(dev):
+        return len(dev.memory_read(dev.soc['sram'][0], size, fast=fast))
+    return workload
+
+# name: (target, workload, iterations)
+WORKLOADS = {
+    'usbdl-poke': ('usbdl', usbdl_poke, 200),
+    'usbdl-peek': ('usbdl', usbdl_peek, 200),
+    'usbdl-read-4k': ('usbdl', usbdl_read(4*1024), 50),
+    'usbdl-read-64k': ('usbdl', usbdl_read(64*1024), 10),
+    'usbdl-read-1m': ('usbdl', usbdl_read(1024*1024), 3),
+    'usbdl-write-4k': ('usbdl', usbdl_write(4*1024), 50),
+    'usbdl-write-64k': ('usbdl', usbdl_write(64*1024), 10),
+    'usbdl-write-1m': ('usbdl', usbdl_write(1024*1024), 3),
+    'usbdl-send-da-256k': ('usbdl', usbdl_send_da(256*1024), 5),
+    'usbdl-cqdma-read-256': ('usbdl', usbdl_cqdma_read(256), 5),
+    'bmo-read-fast-64k': ('bmo', bmo_read(64*1024, True), 5),
+    'bmo-read-slow-4k': ('bmo', bmo_read(4*1024, False), 3),
+}
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+def run_workload(name, dev, transport, workload, iterations):
+    latencies = []
+    byte_count = 0
+    writes = transport.writes
+    reads = transport.reads
+    start_ns = time.perf_counter_ns()
+    for i in range(iterations):
+        op_start_ns = time.perf_counter_ns()
+        moved = workload(dev)
+        latencies.append(time.perf_counter_ns() - op_start_ns)
+        if moved is None:
+            return None
+        byte_count += moved
+    elapsed = max(time.perf_counter_ns() - start_ns, 1)
+
+    transactions = (transport.writes - writes) + (transport.reads - reads)
+
+    return {
+        'name': name,
+        'iterations': iterations,
+        'bytes': byte_count,
+        'seconds': elapsed / 1e9,
+        'bytes_per_second': byte_count * 1e9 / elapsed,
+        'ops_per_second': iterations * 1e9 / elapsed,
+        'transactions': transactions,
+        'transactions_per_second': transactions * 1e9 / elapsed,
+        'latency_p50_us': percentile(latencies, 50) / 1000,
+        'latency_p99_us': percentile(latencies, 99) / 1000,
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-w', '--workload', dest='workloads', type=str, action='append', help="Only run workloads matching this glob. Can be specified multiple times. Default: all of them")
+    parser.add_argument('-o', '--output', type=str, help="The file to write the JSON results to. Default: stdout")
+    parser.add_argument('-H', '--hw-code', type=auto_int, choices=UsbDl.socs.keys(), default=0x0335, metavar="HW_CODE", help="The HW code of the SoC to simulate. Default: 0x0335 (MT6737M)")
+    parser.add_argument('-L', '--latency', type=float, default=0, help="The simulated delay before each response, in seconds. Default: 0")
+    parser.add_argument('-W', '--bandwidth', type=int, help="The simulated USB DL bandwidth, in bytes per second. Default: unlimited")
+    parser.add_argument('-b', '--baudrate', type=int, help="The simulated BMO baud rate. Default: unlimited")
+    parser.add_argument('-p', '--port', type=str, help="Benchmark UsbDl on this port instead of the simulator.")
+    parser.add_argument('-P', '--bmo-port', type=str, help="Benchmark Bmo on this serial port instead of the simulator.")
+    parser.add_argument('-i', '--iterations', type=float, default=1, help="Multiply the number of iterations of each workload by this. Default: 1")
+    args = parser.parse_args()
+
+    names = [name for name in WORKLOADS if not args.workloads or any(fnmatch.fnmatch(name, pattern) for pattern in args.workloads)]
+    targets = set(WORKLOADS[name][0] for name in names)
+
+    results = []
+    # Keep the JSON output clean of the tools' status messages.
+    with contextlib.redirect_stdout(sys.stderr):
+        devs = {}
+        if 'usbdl' in targets:
+            if args.port:
+                transport = CountingTransport(open_transport(args.port))
+            else:
+                transport = CountingTransport(brom_sim.loopback_transport(args.hw_code, latency=args.latency, bandwidth=args.bandwidth))
+            devs['usbdl'] = (UsbDl(None, transport=transport), transport)
+            if args.port:
+                devs['usbdl'][0].unlock_memory_access()
+        if 'bmo' in targets:
+            if args.bmo_port:
+                import serial
+                transport = CountingTransport(serial.Serial(args.bmo_port, args.baudrate or 115200, timeout=1, write_timeout=1))
+            else:
+                transport = CountingTransport(bmo_sim.loopback_transport(args.hw_code, latency=args.latency, baudrate=args.baudrate))
+            dev = Bmo(None, transport=transport)
+            dev.soc = UsbDl.socs[dev.readw(0x08000000)]
+            devs['bmo'] = (dev, transport)
+
+        for name in names:
+            (target, workload, iterations) = WORKLOADS[name]
+            (dev, transport) = devs[target]
+            print("Running {}...".format(name))
+            result = run_workload(name, dev, transport, workload, max(1, int(iterations * args.iterations)))
+            if result is None:
+                print("Skipping {}: not supported on {}.".format(name, dev.soc['name']))
+                continue
+            results.append(result)
+
+    report = {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'config': {
+            'hw_code': args.hw_code,
+            'latency': args.latency,
+            'bandwidth': args.bandwidth,
+            'baudrate': args.baudrate,
+            'port': args.port,
+            'bmo_port': args.bmo_port,
+        },
+        'results': results,
+    }
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    json.dump(report, output, indent=4)
+    output.write('\n')
+    if args.output:
+        output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -22,9 +22,12 @@
 import binascii
 import struct
 import time
+import zlib
 
 import serial
 
+from dumpfile import DumpFile
+
 
 class BmoInitError(Exception):
     pass
@@ -35,6 +38,18 @@ class EchoBytesMismatchException(Exception):
 class NotEnoughDataException(Exception):
     pass
 
+class VectorAckError(Exception):
+    pass
+
+class WriteVerifyError(Exception):
+    pass
+
+def baudrate_arg(value):
+    '''Parse a baud rate argument, which can also be "auto".'''
+    if value == "auto":
+        return value
+    return int(value)
+
 class Bmo:
     commands = {
         'EXIT': ord(b'\r'),
@@ -43,12 +58,68 @@ class Bmo:
         'SETBAUD': ord(b'S'),
         'MEM_READ': ord(b'r'),
         'MEM_WRITE': ord(b'w'),
+        'VECTOR': ord(b'V'),
+        'CHECKSUM': ord(b'C'),
     }
 
-    def __init__(self, port, baudrate=115200, timeout=1, write_timeout=1, debug=False, verbose=False):
+    # Operations for the VECTOR command.
+    vector_ops = {
+        'read': 0,
+        'write': 1,
+        'modify': 2,
+        'poll': 3,
+    }
+
+    # The byte the monitor sends when it starts a VECTOR command.
+    vector_ack = b'v'
+
+    # How long to wait for the VECTOR ack when checking whether the monitor
+    # supports it, in seconds.
+    vector_probe_timeout = 0.1
+
+    # The number of reads a poll operation makes before giving up.
+    vector_poll_limit = 0x100000
+
+    # The byte the monitor sends when it starts a CHECKSUM command.
+    checksum_ack = b'c'
+
+    # How long to wait for the CHECKSUM ack when checking whether the monitor
+    # supports it, in seconds.
+    checksum_probe_timeout = 0.1
+
+    # The number of words memory_write() reads back from each block to verify
+    # it when the monitor doesn't support the CHECKSUM command.
+    write_verify_samples = 8
+
+    # How long to wait for the monitor to go quiet when resyncing with it
+    # after a block failed verification, in seconds.
+    resync_timeout = 0.1
+
+    # The words negotiate_baudrate() writes to its scratch word and reads
+    # back, to check the host-to-device direction at each baud rate.
+    link_test_patterns = (0xa55a3cc3, 0x5aa5c33c)
+
+    # The baud rates negotiate_baudrate() tries by default.
+    negotiate_baudrates = (115200, 230400, 460800, 921600, 1500000, 3000000)
+
+    # How long to give the monitor to reconfigure its UART after SETBAUD, in
+    # seconds.
+    baudrate_settle_time = 0.01
+
+    def __init__(self, port, baudrate=115200, timeout=1, write_timeout=1, debug=False, verbose=False, transport=None):
+        '''Connect to the serial monitor and enter binary mode.
+
+        port: The serial port to connect to.
+        transport: An already-open serial.Serial-like object to use instead
+                   of port, e.g., a transport.LoopbackTransport.
+        '''
         self.debug = debug
         self.verbose = verbose or debug
-        self.ser = serial.Serial(port, baudrate, timeout=timeout, write_timeout=write_timeout)
+        if transport is None:
+            transport = serial.Serial(port, baudrate, timeout=timeout, write_timeout=write_timeout)
+        self.ser = transport
+        self.vector_supported = None
+        self.checksum_supported = None
         self._send_bytes(b'\r' * 10)
         try:
             self._recv_bytes(1000)
@@ -83,6 +154,53 @@ class Bmo:
             raise NotEnoughDataException
         return bytes(data)
 
+    def _recv_into(self, buf):
+        '''Fill a writable buffer with bytes from the serial port.
+
+        buf: A bytearray, memoryview, or other object supporting the writable
+             buffer protocol.
+        '''
+        view = memoryview(buf).cast('B')
+        count = len(view)
+        pos = 0
+        while pos < count:
+            received = self.ser.readinto(view[pos:])
+            if not received:
+                break
+            pos += received
+        if self.debug:
+            print("<- {}".format(binascii.b2a_hex(view[:pos])))
+        if pos != count:
+            raise NotEnoughDataException
+
+    def _block_size(self):
+        '''Return the number of bytes the UART can transfer in about 50 ms
+        at the port's baud rate, or 64 kB if the baud rate isn't known.
+        '''
+        baudrate = getattr(self.ser, 'baudrate', None)
+        if not baudrate:
+            return 0x10000
+        # 8N1 takes ten bits per byte.
+        return max(0x100, (baudrate // 10 // 20) & ~3)
+
+    def _send_paced(self, data):
+        '''Send data a block at a time, never getting more than a block
+        ahead of what the UART can have transmitted at the port's baud rate.
+
+        Otherwise, a large write can fill the OS's buffers and sit there
+        long enough to hit the write timeout.
+        '''
+        baudrate = getattr(self.ser, 'baudrate', None)
+        block_size = self._block_size()
+        start = time.perf_counter()
+        for offset in range(0, len(data), block_size):
+            block = data[offset:offset+block_size]
+            self._send_bytes(block)
+            if baudrate:
+                ahead = (offset * 10 / baudrate) - (time.perf_counter() - start)
+                if ahead > 0:
+                    time.sleep(ahead)
+
     def get_dword(self):
         '''Read a little-endian 32-bit integer from the serial port.'''
         return struct.unpack('<I', self._recv_bytes(4))[0]
@@ -124,6 +242,181 @@ class Bmo:
         self.put_dword(addr)
         self.put_dword(word)
 
+    def _reset_input(self):
+        '''Throw away any bytes waiting to be read, if the port can.'''
+        reset_input_buffer = getattr(self.ser, 'reset_input_buffer', None)
+        if reset_input_buffer:
+            reset_input_buffer()
+
+    def _probe_vector(self):
+        '''Check whether the monitor supports the VECTOR command.
+
+        This sends a VECTOR command with no operations. Monitors that don't
+        know the command ignore it and the zero bytes of its count, so they
+        send nothing back.
+        '''
+        timeout = getattr(self.ser, 'timeout', None)
+        if timeout is not None:
+            self.ser.timeout = self.vector_probe_timeout
+        try:
+            self._send_bytes(struct.pack('<BI', self.commands['VECTOR'], 0))
+            ack = self.ser.read(len(self.vector_ack))
+        finally:
+            if timeout is not None:
+                self.ser.timeout = timeout
+
+        self.vector_supported = (ack == self.vector_ack)
+        if not self.vector_supported:
+            # A monitor that was just slow to ack would otherwise leave the
+            # ack in the buffer, in front of the next response.
+            self._reset_input()
+
+        return self.vector_supported
+
+    def vector(self, records):
+        '''Run a list of register operations with a single command.
+
+        All the operations are sent in one frame, and all of their results
+        come back in one frame, so the whole list costs about one round trip
+        instead of one per read. If the monitor doesn't support the VECTOR
+        command, the operations are done one word at a time instead.
+
+        records: A list of (op, addr, value, mask) tuples, where op is one of:
+            'read': Read the word at addr.
+            'write': Write value to addr.
+            'modify': Replace the bits of the word at addr that are set in
+                      mask with those in value, and return the old word.
+            'poll': Read the word at addr until the bits set in mask differ
+                    from value, giving up after vector_poll_limit reads, and
+                    return the last word read.
+                  The value and mask are ignored by operations that don't
+                  use them.
+
+        Returns a list with the result of each read, modify, and poll, in
+        order.
+        '''
+        if self.vector_supported is None:
+            self._probe_vector()
+        if not self.vector_supported:
+            return self._vector_fallback(records)
+
+        frame = bytearray(struct.pack('<BI', self.commands['VECTOR'], len(records)))
+        result_count = 0
+        for (op, addr, value, mask) in records:
+            frame += struct.pack('<BIII', self.vector_ops[op], addr, value & 0xffffffff, mask & 0xffffffff)
+            if op != 'write':
+                result_count += 1
+        self._send_paced(frame)
+
+        ack = self._recv_bytes(len(self.vector_ack))
+        if ack != self.vector_ack:
+            raise VectorAckError("Invalid VECTOR ACK bytes: {} ({})".format(ack.hex(), repr(ack)))
+
+        buf = bytearray(4 * result_count)
+        self._recv_into(buf)
+        results = list(struct.unpack('<{}I'.format(result_count), buf))
+
+        if self.verbose:
+            pos = 0
+            for (op, addr, value, mask) in records:
+                if op == 'write':
+                    print("0x{:08x} <= 0x{:08x}".format(addr, value))
+                    continue
+                print("0x{:08x} => 0x{:08x} ({})".format(addr, results[pos], op))
+                pos += 1
+
+        return results
+
+    def _vector_fallback(self, records):
+        '''Run the operations of a VECTOR command one word at a time.'''
+        results = []
+        for (op, addr, value, mask) in records:
+            if op == 'read':
+                results.append(self.readw(addr))
+            elif op == 'write':
+                self.writew(addr, value)
+            elif op == 'modify':
+                old = self.readw(addr)
+                self.writew(addr, (old & ~mask & 0xffffffff) | (value & mask))
+                results.append(old)
+            elif op == 'poll':
+                for i in range(self.vector_poll_limit):
+                    word = self.readw(addr)
+                    if (word & mask) != value:
+                        break
+                results.append(word)
+            else:
+                raise ValueError("Unknown vector operation: {}".format(op))
+
+        return results
+
+    def _probe_checksum(self):
+        '''Check whether the monitor supports the CHECKSUM command.
+
+        This asks for the checksum of zero bytes. Monitors that don't know the
+        command ignore it and the zero bytes of its arguments, so they send
+        nothing back.
+        '''
+        timeout = getattr(self.ser, 'timeout', None)
+        if timeout is not None:
+            self.ser.timeout = self.checksum_probe_timeout
+        try:
+            self._send_bytes(struct.pack('<BII', self.commands['CHECKSUM'], 0, 0))
+            ack = self.ser.read(len(self.checksum_ack))
+        finally:
+            if timeout is not None:
+                self.ser.timeout = timeout
+
+        self.checksum_supported = (ack == self.checksum_ack)
+        if self.checksum_supported:
+            self.get_dword()
+        else:
+            # A monitor that was just slow to ack would otherwise leave the
+            # ack and checksum in the buffer, in front of the next response.
+            self._reset_input()
+
+        return self.checksum_supported
+
+    def checksum(self, addr, count):
+        '''Have the monitor calculate the CRC-32 of a range of memory, the
+        same one zlib.crc32() calculates. Only works if checksum_supported is
+        True.
+
+        addr: A 32-bit address as an int.
+        count: The length of the range, in bytes. Must be a multiple of four.
+        '''
+        assert count % 4 == 0
+
+        self._send_bytes(struct.pack('<BII', self.commands['CHECKSUM'], addr, count))
+        ack = self._recv_bytes(len(self.checksum_ack))
+        if ack != self.checksum_ack:
+            raise WriteVerifyError("Invalid CHECKSUM ACK bytes: {} ({})".format(ack.hex(), repr(ack)))
+        crc = self.get_dword()
+
+        if self.verbose:
+            print("crc32(0x{:08x}, 0x{:x}) => 0x{:08x}".format(addr, count, crc))
+
+        return crc
+
+    def _verify_block(self, addr, block):
+        '''Check that a block of memory matches the data written to it.
+
+        With the CHECKSUM command, the whole block is checked. Without it, a
+        sample of write_verify_samples words spread across the block is read
+        back instead, which catches lost and misaligned data but can miss
+        corruption of the words in between.
+        '''
+        if self.checksum_supported is None:
+            self._probe_checksum()
+        if self.checksum_supported:
+            return self.checksum(addr, len(block)) == zlib.crc32(block)
+
+        word_count = len(block) // 4
+        step = max(1, word_count // self.write_verify_samples)
+        offsets = sorted(set(range(0, word_count, step)) | {word_count - 1})
+        words = self.vector([('read', addr + offset * 4, 0, 0) for offset in offsets])
+        return all(word == struct.unpack_from('<I', block, offset * 4)[0] for (offset, word) in zip(offsets, words))
+
     def setbaud(self, baudrate):
         '''Sets the baudrate.'''
 
@@ -131,6 +424,136 @@ class Bmo:
         self.put_dword(baudrate)
         self.close()
 
+    def set_baudrate(self, baudrate):
+        '''Switch the monitor and the serial port to a new baud rate without
+        reconnecting.
+        '''
+        self._send_bytes(struct.pack('<BI', self.commands['SETBAUD'], baudrate))
+
+        # Make sure the command has left the port before changing its speed.
+        flush = getattr(self.ser, 'flush', None)
+        if flush:
+            flush()
+        time.sleep(self.baudrate_settle_time)
+
+        self.ser.baudrate = baudrate
+        reset_input_buffer = getattr(self.ser, 'reset_input_buffer', None)
+        if reset_input_buffer:
+            reset_input_buffer()
+
+    def _measure_link(self, soc_id, test_addr, reference, scratch_addr, scratch_word):
+        '''Check that the link works by reading back known data and writing
+        patterns to a scratch word, and return its throughput in bytes per
+        second, or None if the check failed.
+        '''
+        try:
+            if self.readw(0x08000000) != soc_id:
+                return None
+            start_ns = time.perf_counter_ns()
+            data = self.memory_read(test_addr, len(reference), fast=True)
+            elapsed = max(time.perf_counter_ns() - start_ns, 1)
+            if data != reference:
+                return None
+
+            # Reads only show that the short commands that ask for them got
+            # through, so check the host-to-device direction with writes,
+            # once the reads have shown the link isn't plainly broken. These
+            # use plain WRITE commands so a lost byte can't leave the monitor
+            # waiting for more than negotiate_baudrate() pads out.
+            for pattern in self.link_test_patterns:
+                self.writew(scratch_addr, pattern)
+                if self.readw(scratch_addr) != pattern:
+                    return None
+            self.writew(scratch_addr, scratch_word)
+        except (NotEnoughDataException, EchoBytesMismatchException):
+            return None
+
+        return len(reference) * 1000000000 / elapsed
+
+    def negotiate_baudrate(self, baudrates=None, test_addr=0, test_size=0x400, scratch_addr=0x00100000):
+        '''Find and switch to the fastest baud rate that works, without
+        reconnecting.
+
+        Starting from the current rate, each faster candidate is tried in
+        turn by switching to it, writing link_test_patterns to the word at
+        scratch_addr and reading them back, and reading back test_size bytes
+        at test_addr. The first rate that fails is abandoned by switching back
+        to the last one that worked, and the rate with the highest measured
+        throughput is used, since a USB serial adapter may not actually be
+        faster at a higher nominal rate.
+
+        baudrates: The candidate baud rates. Defaults to negotiate_baudrates.
+        test_addr: The address of memory that reads back the same every time.
+        scratch_addr: The address of a word of RAM that nothing else is using,
+                      which is restored after each test. Defaults to the
+                      start of the SRAM, which the monitor doesn't use.
+
+        Returns the baud rate that was chosen.
+        '''
+        if baudrates is None:
+            baudrates = self.negotiate_baudrates
+
+        current = getattr(self.ser, 'baudrate', None) or min(baudrates)
+        soc_id = self.readw(0x08000000)
+        reference = self.memory_read(test_addr, test_size, fast=True)
+        link = (soc_id, test_addr, reference, scratch_addr, self.readw(scratch_addr))
+        throughputs = {current: self._measure_link(*link)}
+
+        for baudrate in sorted(baudrates):
+            if baudrate <= current:
+                continue
+
+            self.set_baudrate(baudrate)
+            throughput = self._measure_link(*link)
+            if self.debug or self.verbose:
+                print("{} baud: {}".format(baudrate, "{:.0f} bytes per second".format(throughput) if throughput else "failed"))
+            if throughput is None:
+                # Finish off any command the monitor is still waiting for
+                # arguments to (zero bytes aren't commands), then go back to
+                # the last rate that worked.
+                self._send_bytes(bytes(9))
+                self.set_baudrate(current)
+                if self._measure_link(*link) is None:
+                    raise BmoInitError("Lost the connection while trying {} baud.".format(baudrate))
+                break
+
+            throughputs[baudrate] = throughput
+            current = baudrate
+
+        best = max(throughputs, key=lambda baudrate: throughputs[baudrate] or 0)
+        if best != current:
+            self.set_baudrate(best)
+
+        return best
+
+    def apply_baudrate_arg(self, baudrate, baudrate_next):
+        '''Switch to the baud rate a tool was asked to use.
+
+        baudrate: The baud rate the port was opened at.
+        baudrate_next: The value of a baudrate_arg() argument: the baud rate
+                       to switch to, or "auto" to negotiate the fastest one.
+        '''
+        if baudrate_next == "auto":
+            print("Negotiating baud rate...")
+            print("Using {} baud.".format(self.negotiate_baudrate()))
+        elif baudrate_next != baudrate:
+            print("Switching to baudrate to {}...".format(baudrate_next))
+            self.set_baudrate(baudrate_next)
+
+    def _memory_read_into(self, addr, view, fast=False):
+        '''Read a range of memory into a writable buffer whose length is a
+        multiple of four.
+        '''
+        view = memoryview(view).cast('B')
+        assert len(view) % 4 == 0
+
+        if fast:
+            self._send_bytes(struct.pack('<BII', self.commands['MEM_READ'], addr, len(view)))
+            self._recv_into(view)
+        else:
+            for offset in range(0, len(view), 4):
+                struct.pack_into('<I', view, offset, self.readw(addr + offset))
+
     def memory_read(self, addr, count, fast=False, print_speed=False):
         '''Read a range of memory to a byte array.
 
@@ -141,41 +564,139 @@ class Bmo:
         if (count % 4) > 0:
             word_count += 1
 
-        data = b''
+        buf = bytearray(word_count * 4)
+        start_ns = time.perf_counter_ns()
+        self._memory_read_into(addr, buf, fast=fast)
+        end_ns = time.perf_counter_ns()
+        data = bytes(memoryview(buf)[:count])
+
+        if print_speed:
+            elapsed = max(end_ns - start_ns, 1)
+            print("Read {} bytes in {:.6f} seconds ({} bytes per second).".format(len(data), elapsed/1000000000, len(data)*1000000000//elapsed))
+
+        return data
+
+    def memory_read_chunks(self, addr, count, fast=False, chunk_size=None):
+        '''Read a range of memory a chunk at a time.
+
+        This is a generator that yields (address, data) tuples as each chunk
+        arrives. In fast mode, the whole range is requested with a single
+        command, so the monitor keeps streaming the rest of it into the
+        host's receive buffer while the caller is busy with each chunk.
+
+        addr: A 32-bit address as an int.
+        count: The length of data to read, in bytes.
+        chunk_size: The number of bytes to yield at a time. Defaults to about
+                    50 ms worth at the port's baud rate.
+        '''
+        if chunk_size is None:
+            chunk_size = self._block_size()
+        assert chunk_size > 0
+        assert chunk_size % 4 == 0
+
+        word_count = count//4
+        if (count % 4) > 0:
+            word_count += 1
+        aligned_count = word_count * 4
+
         if fast:
-            aligned_count = word_count * 4
+            self._send_bytes(struct.pack('<BII', self.commands['MEM_READ'], addr, aligned_count))
 
-            self._send_bytes([self.commands['MEM_READ']])
-            self.put_dword(addr)
-            self.put_dword(aligned_count)
+        offset = 0
+        try:
+            while offset < aligned_count:
+                length = min(chunk_size, aligned_count - offset)
+                buf = bytearray(length)
+                if fast:
+                    self._recv_into(buf)
+                else:
+                    self._memory_read_into(addr + offset, buf)
+                chunk_addr = addr + offset
+                data = bytes(buf[:count - offset])
+                offset += length
+                yield (chunk_addr, data)
+        except GeneratorExit:
+            # The caller stopped early, so don't leave the rest of the range
+            # to be mistaken for the response to the next command.
+            if fast and offset < aligned_count:
+                self._recv_into(bytearray(aligned_count - offset))
+            raise
+
+    def memory_dump(self, addr, count, path, chunk_size=0x10000, fast=False, print_speed=False):
+        '''Dump a range of memory straight to a file.
+
+        The file is memory-mapped and filled in a chunk at a time as the data
+        arrives, so the range never has to fit in memory.
 
-            block_size = 0x1000
-            cbs = block_size
-            start_ns = time.perf_counter_ns()
-            for i in range(0, aligned_count, block_size):
-                if aligned_count - i < cbs:
-                    cbs = aligned_count - i
-                data += self._recv_bytes(cbs)
-                time.sleep(0.0001)
-            end_ns = time.perf_counter_ns()
-        else:
-            start_ns = time.perf_counter_ns()
-            for i in range(word_count):
-                data += struct.pack('<I', self.readw(addr + i * 4))
-            end_ns = time.perf_counter_ns()
-        data = data[:count]
+        addr: A 32-bit address as an int.
+        count: The length of data to dump, in bytes.
+        path: The file to write the dump to.
+        chunk_size: The number of bytes to read at a time.
+        '''
+        assert chunk_size > 0
+        assert chunk_size % 4 == 0
+
+        start_ns = time.perf_counter_ns()
+        with DumpFile(path, count) as dump:
+            for offset in range(0, count, chunk_size):
+                length = min(chunk_size, count - offset)
+                if length % 4:
+                    dump.write(offset, self.memory_read(addr + offset, length, fast=fast))
+                    continue
+                with dump.view(offset, length) as view:
+                    self._memory_read_into(addr + offset, view, fast=fast)
+        end_ns = time.perf_counter_ns()
 
         if print_speed:
-            elapsed = end_ns - start_ns
-            print("Read {} bytes in {:.6f} seconds ({} bytes per second).".format(len(data), elapsed/1000000000, len(data)*1000000000//elapsed))
+            elapsed = max(end_ns - start_ns, 1)
+            print("Dumped {} bytes in {:.6f} seconds ({} bytes per second).".format(count, elapsed/1000000000, count*1000000000//elapsed))
 
-        return data
+    def _memory_write_block(self, addr, block, fast=False):
+        if fast:
+            self._send_bytes(struct.pack('<BII', self.commands['MEM_WRITE'], addr, len(block)))
+            self._send_paced(block)
+        else:
+            for i in range(0, len(block), 4):
+                self.writew(addr + i, struct.unpack_from('<I', block, i)[0])
+
+    def _resync(self, pending=0):
+        '''Get the monitor back to waiting for a command after a garbled
+        block, and throw away anything it sent back in the meantime.
+
+        pending: The most payload bytes the monitor could still be waiting
+                 for.
+        '''
+        # Zero bytes aren't commands, so these finish off the payload and the
+        # arguments of any command the monitor parsed out of the garbage,
+        # and are ignored after that.
+        self._send_paced(bytes(pending + 9))
+
+        timeout = getattr(self.ser, 'timeout', None)
+        if timeout is not None:
+            self.ser.timeout = self.resync_timeout
+        try:
+            while self.ser.read(0x1000):
+                continue
+        finally:
+            if timeout is not None:
+                self.ser.timeout = timeout
 
-    def memory_write(self, addr, data, fast=False, print_speed=False):
+    def memory_write(self, addr, data, fast=False, print_speed=False, verify=False, retries=3):
         '''Write a byte array to a range of memory.
 
         addr: A 32-bit address as an int.
         data: The data to write.
+        verify: Whether to check each block after writing it, and resend the
+                blocks that don't match. The blocks are about 50 ms worth at
+                the port's baud rate, and are checked with the monitor's
+                CHECKSUM command, or by reading back a sample of words from
+                them if it doesn't have one. A block whose check gets no
+                sensible response, e.g., because a lost byte left the
+                monitor still reading the block when the check was sent,
+                counts as not matching, and the monitor is resynced before
+                the block is resent.
+        retries: The number of times to resend a block that doesn't match
+                 before giving up with a WriteVerifyError.
         '''
         data = bytes(data)
 
@@ -185,23 +706,36 @@ class Bmo:
         if remaining_bytes > 0:
             padded_data += b'\0' * (4 - remaining_bytes)
 
-        if fast:
-            self._send_bytes([self.commands['MEM_WRITE']])
-            self.put_dword(addr)
-            self.put_dword(len(padded_data))
-
-            block_size = 0x1000
-            start_ns = time.perf_counter_ns()
-            for i in range(0, len(padded_data), block_size):
-                self._send_bytes(padded_data[i:i+block_size])
-                time.sleep(0.0001)
-            end_ns = time.perf_counter_ns()
+        resent = 0
+        start_ns = time.perf_counter_ns()
+        if not verify:
+            self._memory_write_block(addr, padded_data, fast=fast)
         else:
-            start_ns = time.perf_counter_ns()
-            for i in range(0, len(padded_data), 4):
-                self.writew(addr + i, struct.unpack_from('<I', padded_data, i)[0])
-            end_ns = time.perf_counter_ns()
+            # Probe before the first block, so a garbled block can't make the
+            # probe fail.
+            if self.checksum_supported is None:
+                self._probe_checksum()
+
+            block_size = self._block_size()
+            view = memoryview(padded_data)
+            for offset in range(0, len(padded_data), block_size):
+                block = view[offset:offset+block_size]
+                for attempt in range(retries + 1):
+                    self._memory_write_block(addr + offset, block, fast=fast)
+                    try:
+                        if self._verify_block(addr + offset, block):
+                            break
+                    except (NotEnoughDataException, VectorAckError, WriteVerifyError):
+                        pass
+                    print("Block at 0x{:08x} failed verification.".format(addr + offset))
+                    resent += 1
+                    self._resync(len(block) if fast else 0)
+                else:
+                    raise WriteVerifyError("Failed to write 0x{:x} bytes to 0x{:08x} after {} retries.".format(len(block), addr + offset, retries))
+        end_ns = time.perf_counter_ns()
 
         if print_speed:
-            elapsed = end_ns - start_ns
+            elapsed = max(end_ns - start_ns, 1)
             print("Wrote {} bytes in {:.6f} seconds ({} bytes per second).".format(len(data), elapsed/1000000000, len(data)*1000000000//elapsed))
+            if resent:
+                print("Resent {} blocks that failed verification.".format(resent))
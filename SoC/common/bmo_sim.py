@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# bmo_sim.py - A simulator for the serial monitor and its Binary MOde protocol,
+# for testing and benchmarking without a real device.
+# Copyright (C) 2019-2021  Forest Crossman <cyrozap@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import argparse
+import random
+import struct
+import time
+import zlib
+
+from bmo import Bmo
+from brom_sim import serve_pty
+from transport import LoopbackTransport
+from usbdl import UsbDl, auto_int
+
+
+class BmoSimulator:
+    '''Simulates the serial monitor in demo/hello-aarch64, including its
+    command line and binary mode.
+
+    Feed the bytes the host sends to process(), which returns the bytes the
+    monitor sends back.
+
+    hw_code: The chip ID the simulated SoC reports at 0x08000000.
+    latency: A delay, in seconds, before each response.
+    baudrate: The simulated UART baud rate, used to limit the response rate,
+              or None for no limit.
+    vector: Whether to support the VECTOR command, which older monitors
+            don't.
+    max_baudrate: The fastest baud rate the simulated link works at. Above
+                  it, every response is corrupted.
+    checksum: Whether to support the CHECKSUM command, which older monitors
+              don't.
+    write_error_rate: The chance of each word written with MEM_WRITE being
+                      corrupted.
+    '''
+
+    def __init__(self, hw_code=0x0335, latency=0, baudrate=None, vector=True, max_baudrate=None, checksum=True, write_error_rate=0):
+        self.hw_code = hw_code
+        self.soc = UsbDl.socs[hw_code]
+        self.latency = latency
+        self.baudrate = baudrate
+        self.vector = vector
+        self.max_baudrate = max_baudrate
+        self.checksum = checksum
+        self.write_error_rate = write_error_rate
+
+        self.memory = {
+            0x08000000: hw_code,
+        }
+
+        # Registers that change on their own. Each maps an address to a list
+        # of the words successive reads return, the last of which sticks.
+        self.registers = {}
+
+        self.rx = bytearray()
+        self.tx = bytearray()
+        self.handler = self._protocol()
+        self.needed = next(self.handler)
+
+    def read_word(self, addr):
+        values = self.registers.get(addr)
+        if values:
+            word = values.pop(0) if len(values) > 1 else values[0]
+            return word & 0xffffffff
+
+        # Unwritten memory reads back as a pattern derived from its address.
+        return self.memory.get(addr, (addr * 0x9e3779b1) & 0xffffffff)
+
+    def write_word(self, addr, word):
+        self.memory[addr] = word & 0xffffffff
+
+    def process(self, data):
+        '''Handle bytes from the host and return the bytes sent in response.'''
+        self.rx += data
+        while len(self.rx) >= self.needed:
+            chunk = bytes(self.rx[:self.needed])
+            del self.rx[:self.needed]
+            self.needed = self.handler.send(chunk)
+
+        response = bytes(self.tx)
+        self.tx.clear()
+
+        if self.max_baudrate and self.baudrate and self.baudrate > self.max_baudrate:
+            response = bytes(b ^ 0x55 for b in response)
+
+        if response:
+            delay = self.latency
+            if self.baudrate:
+                # 8N1 takes ten bits per byte.
+                delay += len(response) * 10 / self.baudrate
+            if delay > 0:
+                time.sleep(delay)
+
+        return response
+
+    def _dword(self):
+        data = yield 4
+        return struct.unpack('<I', data)[0]
+
+    def _putline(self, line):
+        self.tx += line.replace(b'\n', b'\r\n')
+
+    def _protocol(self):
+        line = b''
+        while True:
+            c = yield 1
+            if c != b'\r':
+                # Echo the character, like the command line does.
+                self.tx += c
+                line += c
+                continue
+
+            self._putline(b'\n')
+            if line.strip() == b'bmo':
+                self._putline(b'OK\n')
+                yield from self._binary_mode()
+            line = b''
+            self.tx += b'> '
+
+    def _binary_mode(self):
+        while True:
+            command = (yield 1)[0]
+            if command == Bmo.commands['EXIT']:
+                return
+            elif command == Bmo.commands['READ']:
+                addr = yield from self._dword()
+                self.tx += struct.pack('<I', self.read_word(addr))
+            elif command == Bmo.commands['WRITE']:
+                addr = yield from self._dword()
+                word = yield from self._dword()
+                self.write_word(addr, word)
+            elif command == Bmo.commands['SETBAUD']:
+                self.baudrate = yield from self._dword()
+            elif command == Bmo.commands['MEM_READ']:
+                addr = yield from self._dword()
+                length = yield from self._dword()
+                for offset in range(0, length, 4):
+                    self.tx += struct.pack('<I', self.read_word(addr + offset))
+            elif command == Bmo.commands['MEM_WRITE']:
+                addr = yield from self._dword()
+                length = yield from self._dword()
+                for offset in range(0, length, 4):
+                    word = yield from self._dword()
+                    if self.write_error_rate and random.random() < self.write_error_rate:
+                        word ^= 1 << random.randrange(32)
+                    self.write_word(addr + offset, word)
+            elif command == Bmo.commands['VECTOR'] and self.vector:
+                count = yield from self._dword()
+                self.tx += Bmo.vector_ack
+                for i in range(count):
+                    op = (yield 1)[0]
+                    addr = yield from self._dword()
+                    value = yield from self._dword()
+                    mask = yield from self._dword()
+                    if op == Bmo.vector_ops['read']:
+                        self.tx += struct.pack('<I', self.read_word(addr))
+                    elif op == Bmo.vector_ops['write']:
+                        self.write_word(addr, value)
+                    elif op == Bmo.vector_ops['modify']:
+                        old = self.read_word(addr)
+                        self.write_word(addr, (old & ~mask) | (value & mask))
+                        self.tx += struct.pack('<I', old)
+                    elif op == Bmo.vector_ops['poll']:
+                        for tries in range(Bmo.vector_poll_limit):
+                            word = self.read_word(addr)
+                            if (word & mask) != value:
+                                break
+                        self.tx += struct.pack('<I', word)
+            elif command == Bmo.commands['CHECKSUM'] and self.checksum:
+                addr = yield from self._dword()
+                length = yield from self._dword()
+                data = b''.join(struct.pack('<I', self.read_word(addr + offset)) for offset in range(0, length, 4))
+                self.tx += Bmo.checksum_ack
+                self.tx += struct.pack('<I', zlib.crc32(data))
+
+
+def loopback_transport(hw_code=0x0335, **kwargs):
+    '''Return a transport connected to a new in-process BmoSimulator.
+
+    Takes the same keyword arguments as BmoSimulator.
+    '''
+    sim = BmoSimulator(hw_code, **kwargs)
+    transport = LoopbackTransport(sim.process)
+    transport.sim = sim
+    return transport
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-H', '--hw-code', type=auto_int, choices=UsbDl.socs.keys(), default=0x0335, metavar="HW_CODE", help="The chip ID of the SoC to simulate. Default: 0x0335 (MT6737M)")
+    parser.add_argument('-L', '--latency', type=float, default=0, help="The delay before each response, in seconds. Default: 0")
+    parser.add_argument('-b', '--baudrate', type=int, help="The baud rate to limit the response rate to. Default: unlimited")
+    parser.add_argument('-V', '--no-vector', action='store_true', help="Act like an older monitor without the VECTOR command.")
+    parser.add_argument('-M', '--max-baudrate', type=int, help="The fastest baud rate the link works at. Default: unlimited")
+    parser.add_argument('-C', '--no-checksum', action='store_true', help="Act like an older monitor without the CHECKSUM command.")
+    parser.add_argument('-e', '--write-error-rate', type=float, default=0, help="The chance of each word written with MEM_WRITE being corrupted. Default: 0")
+    args = parser.parse_args()
+
+    sim = BmoSimulator(args.hw_code, latency=args.latency, baudrate=args.baudrate, vector=not args.no_vector, max_baudrate=args.max_baudrate,
+        checksum=not args.no_checksum, write_error_rate=args.write_error_rate)
+    serve_pty(sim)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# brom_sim.py - A simulator for the USB Download Mode protocol of MediaTek
+# BROMs, for testing and benchmarking without a real device.
+# Copyright (C) 2019-2021  Forest Crossman <cyrozap@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import argparse
+import os
+import struct
+import time
+import tty
+
+from transport import LoopbackTransport
+from usbdl import UsbDl, XorChecksum, auto_int
+
+
+# The real error codes haven't been documented yet, so any value above 0xff
+# will do.
+STATUS_OK = 0x0000
+STATUS_ACCESS_DENIED = 0x1d0c
+
+CMDS = {value: name for name, value in UsbDl.commands.items()}
+
+
+class BromSimulator:
+    '''Simulates the BROM side of the USB DL protocol.
+
+    Feed the bytes the host sends to process(), which returns the bytes the
+    BROM sends back.
+
+    hw_code: The HW code of the SoC to simulate. Must be in UsbDl.socs.
+    latency: A delay, in seconds, before each response.
+    bandwidth: The maximum response rate, in bytes per second, or None for no
+               limit.
+    brom_mode: Whether to act like the BROM (True) or the preloader (False).
+    '''
+
+    bl_ver = 0x01
+    hw_subcode = 0x8a00
+    hw_ver = 0xca00
+    sw_ver = 0x0000
+    target_config = 0x00000000
+
+    def __init__(self, hw_code, latency=0, bandwidth=None, brom_mode=True):
+        self.hw_code = hw_code
+        self.soc = UsbDl.socs[hw_code]
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.brom_mode = brom_mode
+
+        self.memory = {}
+        self.brom_log = b"[BROM] Simulated\r\n"
+        self.payloads = []
+        self.jumps = []
+
+        self.rx = bytearray()
+        self.tx = bytearray()
+        self.handler = self._protocol()
+        self.needed = next(self.handler)
+
+    def readable(self, addr):
+        '''Whether an address can be accessed with CMD_READ32/CMD_WRITE32.'''
+        return addr < 0x80000000
+
+    def read_word(self, addr):
+        # Unwritten memory reads back as a pattern derived from its address.
+        return self.memory.get(addr, (addr * 0x9e3779b1) & 0xffffffff)
+
+    def write_word(self, addr, word):
+        self.memory[addr] = word & 0xffffffff
+
+        # Simulate the CQDMA finishing each transfer instantly.
+        cqdma_base = self.soc.get('cqdma_base')
+        if cqdma_base is not None and addr == cqdma_base + 0x08 and (word & 1):
+            src = self.read_word(cqdma_base + 0x1C)
+            dst = self.read_word(cqdma_base + 0x20)
+            length = self.read_word(cqdma_base + 0x24)
+            for offset in range(0, length, 4):
+                self.memory[dst + offset] = self.read_word(src + offset)
+            self.memory[addr] = 0
+
+    def process(self, data):
+        '''Handle bytes from the host and return the bytes sent in response.'''
+        self.rx += data
+        while len(self.rx) >= self.needed:
+            chunk = bytes(self.rx[:self.needed])
+            del self.rx[:self.needed]
+            self.needed = self.handler.send(chunk)
+
+        response = bytes(self.tx)
+        self.tx.clear()
+
+        if response:
+            delay = self.latency
+            if self.bandwidth:
+                delay += len(response) / self.bandwidth
+            if delay > 0:
+                time.sleep(delay)
+
+        return response
+
+    def _status(self, status=STATUS_OK):
+        self.tx += struct.pack('>H', status)
+
+    def _field(self, size, echo=True):
+        data = yield size
+        if echo:
+            self.tx += data
+        return data
+
+    def _dword(self):
+        data = yield from self._field(4)
+        return struct.unpack('>I', data)[0]
+
+    def _payload(self, length):
+        data = yield from self._field(length, echo=False)
+        self.payloads.append(data)
+        self.tx += struct.pack('>H', XorChecksum(data).value())
+        self._status()
+
+    def _protocol(self):
+        while True:
+            opcode = yield 1
+            command = CMDS.get(opcode[0])
+
+            if command is None:
+                # Reply the way an unhandshaked device does.
+                self.tx.append((opcode[0] + 1) & 0xff)
+                continue
+
+            if command == 'CMD_GET_BL_VER' and not self.brom_mode:
+                # The preloader replies with its version instead of echoing.
+                self.tx.append(self.bl_ver)
+                continue
+
+            self.tx += opcode
+
+            if command == 'CMD_GET_HW_CODE':
+                self.tx += struct.pack('>H', self.hw_code)
+                self._status()
+            elif command == 'CMD_GET_HW_SW_VER':
+                self.tx += struct.pack('>HHH', self.hw_subcode, self.hw_ver, self.sw_ver)
+                self._status()
+            elif command == 'CMD_GET_BL_VER':
+                pass
+            elif command == 'CMD_GET_TARGET_CONFIG':
+                self.tx += struct.pack('>I', self.target_config)
+                self._status()
+            elif command == 'CMD_READ32':
+                addr = yield from self._dword()
+                count = yield from self._dword()
+                if not all(self.readable(addr + i * 4) for i in range(count)):
+                    self._status(STATUS_ACCESS_DENIED)
+                    continue
+                self._status()
+                self.tx += struct.pack('>{}I'.format(count), *[self.read_word(addr + i * 4) for i in range(count)])
+                self._status()
+            elif command == 'CMD_WRITE32':
+                addr = yield from self._dword()
+                count = yield from self._dword()
+                if not all(self.readable(addr + i * 4) for i in range(count)):
+                    self._status(STATUS_ACCESS_DENIED)
+                    continue
+                self._status()
+                for i in range(count):
+                    word = yield from self._dword()
+                    self.write_word(addr + i * 4, word)
+                self._status()
+            elif command in ('CMD_JUMP_DA', 'CMD_JUMP_DA_64'):
+                addr = yield from self._dword()
+                if command == 'CMD_JUMP_DA_64':
+                    yield from self._field(1)
+                    self._status()
+                    yield from self._field(1)
+                self.jumps.append(addr)
+                self._status()
+            elif command == 'CMD_JUMP_BL':
+                self._status()
+            elif command == 'CMD_SEND_DA':
+                addr = yield from self._dword()
+                length = yield from self._dword()
+                sig_length = yield from self._dword()
+                self._status()
+                yield from self._payload(length)
+            elif command in ('SCMD_SEND_CERT', 'SCMD_SEND_AUTH'):
+                length = yield from self._dword()
+                self._status()
+                yield from self._payload(length)
+            elif command == 'CMD_UART1_LOG_EN':
+                self._status()
+            elif command == 'CMD_UART1_SET_BAUD':
+                yield from self._dword()
+                self._status()
+            elif command in ('CMD_GET_BROM_LOG', 'CMD_GET_BROM_LOG_NEW'):
+                self.tx += struct.pack('>I', len(self.brom_log))
+                self.tx += self.brom_log
+                if command == 'CMD_GET_BROM_LOG_NEW':
+                    self._status()
+            elif command in ('SCMD_GET_ME_ID', 'SCMD_GET_SOC_ID'):
+                data = bytes(16) if command == 'SCMD_GET_ME_ID' else bytes(32)
+                self.tx += struct.pack('>I', len(data))
+                self.tx += data
+                self._status()
+            elif command == 'CMD_C8':
+                yield from self._field(1)
+                self.tx.append(0)
+                self._status()
+
+
+def loopback_transport(hw_code, **kwargs):
+    '''Return a transport connected to a new in-process BromSimulator.
+
+    Takes the same keyword arguments as BromSimulator.
+    '''
+    sim = BromSimulator(hw_code, **kwargs)
+    transport = LoopbackTransport(sim.process)
+    transport.sim = sim
+    return transport
+
+def serve_pty(sim):
+    '''Serve the simulator on a new pseudo-terminal until interrupted.'''
+    (master, slave) = os.openpty()
+    tty.setraw(slave)
+    print("Simulating {} on {}".format(sim.soc['name'], os.ttyname(slave)), flush=True)
+
+    try:
+        while True:
+            try:
+                data = os.read(master, 0x10000)
+            except OSError:
+                # Nothing has the other end open.
+                time.sleep(0.01)
+                continue
+            response = sim.process(data)
+            if response:
+                os.write(master, response)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        os.close(master)
+        os.close(slave)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-H', '--hw-code', type=auto_int, choices=UsbDl.socs.keys(), default=0x0335, metavar="HW_CODE", help="The HW code of the SoC to simulate. Default: 0x0335 (MT6737M)")
+    parser.add_argument('-L', '--latency', type=float, default=0, help="The delay before each response, in seconds. Default: 0")
+    parser.add_argument('-W', '--bandwidth', type=int, help="The maximum response rate, in bytes per second. Default: unlimited")
+    parser.add_argument('-P', '--preloader', action='store_true', help="Act like the preloader instead of the BROM.")
+    args = parser.parse_args()
+
+    sim = BromSimulator(args.hw_code, latency=args.latency, bandwidth=args.bandwidth, brom_mode=not args.preloader)
+    serve_pty(sim)
+
+
+if __name__ == "__main__":
+    main()
@@ -586,8 +586,91 @@ typedef enum bmo_commands {
 	SETBAUD = 'S',
 	MEM_READ = 'r',
 	MEM_WRITE = 'w',
+	VECTOR = 'V',
+	CHECKSUM = 'C',
 } bmo_command_t;
 
+typedef enum bmo_vector_ops {
+	VECTOR_OP_READ = 0,
+	VECTOR_OP_WRITE = 1,
+	VECTOR_OP_MODIFY = 2,
+	VECTOR_OP_POLL = 3,
+} bmo_vector_op_t;
+
+#define VECTOR_ACK 'v'
+#define VECTOR_POLL_LIMIT 0x100000
+#define CHECKSUM_ACK 'c'
+
+static uint32_t bmo_getword(void) {
+	uint32_t word = 0;
+	for (int i = 0; i < 4; i++) {
+		word |= getchar() << (i * 8);
+	}
+	return word;
+}
+
+static void bmo_putword(uint32_t word) {
+	for (int i = 0; i < 4; i++) {
+		putbyte((word >> (i * 8)) & 0xff);
+	}
+}
+
+static void bmo_vector(uint32_t count) {
+	// Acknowledge the command so the host can tell that it's supported.
+	putbyte(VECTOR_ACK);
+
+	for (uint32_t i = 0; i < count; i++) {
+		bmo_vector_op_t op = getchar();
+		uint32_t addr = bmo_getword();
+		uint32_t val = bmo_getword();
+		uint32_t mask = bmo_getword();
+		uint32_t old = 0;
+		uint32_t tries = VECTOR_POLL_LIMIT;
+
+		switch (op) {
+		case VECTOR_OP_READ:
+			bmo_putword(readw(addr));
+			break;
+		case VECTOR_OP_WRITE:
+			writew(addr, val);
+			break;
+		case VECTOR_OP_MODIFY:
+			old = readw(addr);
+			writew(addr, (old & ~mask) | (val & mask));
+			bmo_putword(old);
+			break;
+		case VECTOR_OP_POLL:
+			// Wait for the masked value to change from val, giving up
+			// eventually so the host can't hang the monitor.
+			do {
+				old = readw(addr);
+			} while (((old & mask) == val) && --tries);
+			bmo_putword(old);
+			break;
+		default:
+			break;
+		}
+	}
+}
+
+static void bmo_checksum(uint32_t addr, uint32_t len) {
+	// Acknowledge the command so the host can tell that it's supported.
+	putbyte(CHECKSUM_ACK);
+
+	// CRC-32, the same one zlib uses, over the bytes of each word.
+	uint32_t crc = 0xffffffff;
+	for (uint32_t off = 0; off < len; off += 4) {
+		uint32_t val = readw(addr + off);
+		for (int i = 0; i < 4; i++) {
+			crc ^= (val >> (i * 8)) & 0xff;
+			for (int bit = 0; bit < 8; bit++) {
+				crc = (crc >> 1) ^ (0xedb88320 & -(crc & 1));
+			}
+		}
+	}
+	bmo_putword(~crc);
+}
+
 static int bmo_handler(size_t argc, const char * argv[]) {
 	int ret = 0;
 	int done = 0;
@@ -655,6 +738,14 @@ static int bmo_handler(size_t argc, const char * argv[]) {
 				writew(addr + off, val);
 			}
 			break;
+		case VECTOR:
+			bmo_vector(bmo_getword());
+			break;
+		case CHECKSUM:
+			addr = bmo_getword();
+			len = bmo_getword();
+			bmo_checksum(addr, len);
+			break;
 		default:
 			break;
 		}
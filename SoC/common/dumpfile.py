@@ -0,0 +1,73 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# dumpfile.py - Memory-mapped output files for memory dumps.
+# Copyright (C) 2019-2021  Forest Crossman <cyrozap@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import mmap
+
+
+class DumpFile:
+    '''A memory-mapped output file to dump a range of memory into.
+
+    The file is created at its full size up front without writing anything to
+    it, so on filesystems that support sparse files, ranges that are never
+    written (like memory that couldn't be read) take up no space, and read
+    back as zeros. Data is copied straight into the mapping at its offset as
+    it arrives, and the OS writes it out, so the host never needs to hold the
+    whole dump in memory.
+
+    path: The file to create. An existing file is overwritten.
+    size: The size of the dump, in bytes.
+    '''
+
+    def __init__(self, path, size):
+        self.size = size
+        self.file = open(path, 'w+b')
+        self.file.truncate(size)
+        self.map = None
+        if size > 0:
+            self.map = mmap.mmap(self.file.fileno(), size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, offset, data):
+        '''Copy data into the dump at an offset.'''
+        data = memoryview(data).cast('B')
+        self.map[offset:offset+len(data)] = data
+
+    def clear(self, offset, count):
+        '''Zero part of the dump, e.g., after a failed read left partial data
+        in it.
+        '''
+        self.map[offset:offset+count] = bytes(count)
+
+    def view(self, offset, count):
+        '''Return a writable memoryview of part of the dump, for receiving
+        data into directly. Release it before closing the dump.
+        '''
+        return memoryview(self.map)[offset:offset+count]
+
+    def close(self):
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.map = None
+        self.file.close()
@@ -22,7 +22,7 @@ import argparse
 import struct
 import time
 
-from bmo import Bmo
+from bmo import Bmo, baudrate_arg
 from usbdl import UsbDl
 
 
@@ -103,8 +103,11 @@ class Gcpu(Bmo):
         return value
 
     def regs_read(self):
+        records = []
         for reg in range(32):
-            yield reg, self.reg_read(reg)
+            records.append(('write', self.gcpu_base + 0x414, reg, 0))
+            records.append(('read', self.gcpu_base + 0x410, 0, 0))
+        return enumerate(self.vector(records))
 
     def print_regs(self):
         regs = ["R{}: 0x{:08x}".format(reg, value) for reg, value in self.regs_read()]
@@ -118,11 +121,10 @@ class Gcpu(Bmo):
         print(", ".join(regs[28:]))
 
     def im_read(self, word_addr : int, word_count : int):
-        word_array = []
-        self.writew(self.gcpu_base + 0x404, word_addr)
-        for i in range(word_count):
-            word_array.append(struct.pack('<I', self.readw(self.gcpu_base + 0x408)))
-        return b''.join(word_array)
+        records = [('write', self.gcpu_base + 0x404, word_addr, 0)]
+        records += [('read', self.gcpu_base + 0x408, 0, 0)] * word_count
+        words = self.vector(records)
+        return struct.pack('<{}I'.format(word_count), *words)
 
     def im_write(self, word_addr : int, words : bytes):
         assert len(words) % 4 == 0
@@ -197,7 +199,7 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('port', type=str, help="The serial port you want to connect to.")
     parser.add_argument('-b', '--baudrate', type=int, default=115200, help="The baud rate you want to connect at. Default: 115200")
-    parser.add_argument('-s', '--baudrate-next', type=int, default=115200, help="The baud rate you want to switch to. Default: 115200")
+    parser.add_argument('-s', '--baudrate-next', type=baudrate_arg, default=115200, help="The baud rate you want to switch to, or \"auto\" to use the fastest one that works. Default: 115200")
     args = parser.parse_args()
 
     verbose = False
@@ -208,11 +210,7 @@ def main():
     #time.sleep(1)
 
     gcpu = Gcpu(args.port, baudrate=args.baudrate, debug=False, verbose=verbose)
-    if args.baudrate_next != args.baudrate:
-        print("Switching to baudrate to {}...".format(args.baudrate_next))
-        gcpu.setbaud(args.baudrate_next)
-
-        gcpu = Gcpu(args.port, baudrate=args.baudrate_next, debug=False, verbose=verbose)
+    gcpu.apply_baudrate_arg(args.baudrate, args.baudrate_next)
 
     # Reset GCPU state.
     gcpu.ccpu_reset()
@@ -22,7 +22,7 @@ import argparse
 import struct
 import time
 
-from bmo import Bmo
+from bmo import Bmo, baudrate_arg
 from usbdl import UsbDl
 
 
@@ -112,26 +112,33 @@ class Md32(Bmo):
         self.writew(self.cfgreg_base + 0x0, 1)
 
     def ocd_instr(self, instr, data=None):
-        # Wait for OCD to become ready.
-        while not self.readw(self.cfgreg_base + 0x58):
-            continue
+        # Wait for OCD to become ready. This is a command of its own so
+        # nothing gets written while OCD is still busy.
+        (ready_before,) = self.vector([('poll', self.cfgreg_base + 0x58, 0, 0xffffffff)])
+        if not ready_before:
+            raise TimeoutError("MD32 OCD did not become ready.")
 
         # Write the instruction.
-        self.writew(self.cfgreg_base + 0x48, (1 << 11) | instr)
-        self.writew(self.cfgreg_base + 0x44, 1)
-        self.writew(self.cfgreg_base + 0x44, 0)
+        records = [('write', self.cfgreg_base + 0x48, (1 << 11) | instr, 0)]
+        records.append(('write', self.cfgreg_base + 0x44, 1, 0))
+        records.append(('write', self.cfgreg_base + 0x44, 0, 0))
 
         if data is not None:
             # Write the data.
-            self.writew(self.cfgreg_base + 0x50, data)
-            self.writew(self.cfgreg_base + 0x4c, 1)
-            self.writew(self.cfgreg_base + 0x4c, 0)
+            records.append(('write', self.cfgreg_base + 0x50, data, 0))
+            records.append(('write', self.cfgreg_base + 0x4c, 1, 0))
+            records.append(('write', self.cfgreg_base + 0x4c, 0, 0))
 
         # Wait for OCD to become ready again.
-        while not self.readw(self.cfgreg_base + 0x58):
-            continue
+        records.append(('poll', self.cfgreg_base + 0x58, 0, 0xffffffff))
 
-        return self.readw(self.cfgreg_base + 0x54)
+        records.append(('read', self.cfgreg_base + 0x54, 0, 0))
+
+        (ready_after, result) = self.vector(records)
+        if not ready_after:
+            raise TimeoutError("MD32 OCD did not become ready.")
+
+        return result
 
     def ocd_wait_ready(self):
         start = time.monotonic()
@@ -244,17 +251,17 @@ class Md32(Bmo):
         print(", ".join(sfrs[10:10+3]))
         print(", ".join(sfrs[13:]))
 
-    def tcm_load(self, data : int):
+    def tcm_load(self, data : int, fast : bool = False):
         assert len(data) % 4 == 0
 
-        self.memory_write(self.tcm_base, data, print_speed=True)
+        self.memory_write(self.tcm_base, data, fast=fast, print_speed=True, verify=True)
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('port', type=str, help="The serial port you want to connect to.")
     parser.add_argument('-b', '--baudrate', type=int, default=115200, help="The baud rate you want to connect at. Default: 115200")
-    parser.add_argument('-s', '--baudrate-next', type=int, default=115200, help="The baud rate you want to switch to. Default: 115200")
+    parser.add_argument('-s', '--baudrate-next', type=baudrate_arg, default=115200, help="The baud rate you want to switch to, or \"auto\" to use the fastest one that works. Default: 115200")
     args = parser.parse_args()
 
     verbose = False
@@ -265,19 +272,14 @@ def main():
     #time.sleep(1)
 
     md32 = Md32(args.port, baudrate=args.baudrate, debug=False, verbose=verbose)
-    if args.baudrate_next != args.baudrate:
-        print("Switching to baudrate to {}...".format(args.baudrate_next))
-        md32.setbaud(args.baudrate_next)
-
-        md32 = Md32(args.port, baudrate=args.baudrate_next, debug=False, verbose=verbose)
+    md32.apply_baudrate_arg(args.baudrate, args.baudrate_next)
 
     # Reset MD32 state.
     md32.md32_reset()
 
     # Insert software breakpoint to make sure we don't mess up the CPU state.
     bp = struct.pack('<I', 0x05400000)
-    md32.memory_write(md32.tcm_base, bp)
-    assert bp == md32.memory_read(md32.tcm_base, 4)
+    md32.memory_write(md32.tcm_base, bp, verify=True)
 
     # Release from reset.
     md32.md32_run()
@@ -24,7 +24,7 @@ import struct
 import sys
 import time
 
-from bmo import Bmo
+from bmo import Bmo, baudrate_arg
 
 
 class Pcm(Bmo):
@@ -92,14 +92,13 @@ class Pcm(Bmo):
         self.writew(self.spm_base + 0x354, 0xffffffff)
 
         # Enable CPU power down and dormant.
-        self.writew(self.spm_base + 0x400, self.readw(self.spm_base + 0x400) & ~(1 << 14))
+        self.vector([('modify', self.spm_base + 0x400, 0, 1 << 14)])
 
     def reg_read(self, reg : int):
         return self.readw(self.spm_base + 0x380 + 4 * reg)
 
     def regs_read(self):
-        for i in range(16):
-            yield self.reg_read(i)
+        return self.vector([('read', self.spm_base + 0x380 + 4 * reg, 0, 0) for reg in range(16)])
 
     def print_regs(self):
         regs = ["R{}: 0x{:08x}".format(reg, value) for reg, value in enumerate(self.regs_read())]
@@ -143,10 +142,10 @@ class Pcm(Bmo):
         con1 = self.readw(self.spm_base + 0x314) & ~(1 << 0)
         self.writew(self.spm_base + 0x314, con1 | (0x0b16 << 16) | (mode << 0))
 
-    def im_load(self, addr : int, data : int):
+    def im_load(self, addr : int, data : int, fast : bool = False):
         assert len(data) % 4 == 0
 
-        self.memory_write(addr, data, print_speed=True)
+        self.memory_write(addr, data, fast=fast, print_speed=True, verify=True)
 
         self.writew(self.spm_base + 0x318, addr)
         self.writew(self.spm_base + 0x31c, len(data) // 4)
@@ -202,7 +201,8 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('port', type=str, help="The serial port you want to connect to.")
     parser.add_argument('-b', '--baudrate', type=int, default=115200, help="The baud rate you want to connect at. Default: 115200")
-    parser.add_argument('-s', '--baudrate-next', type=int, default=115200, help="The baud rate you want to switch to. Default: 115200")
+    parser.add_argument('-s', '--baudrate-next', type=baudrate_arg, default=115200, help="The baud rate you want to switch to, or \"auto\" to use the fastest one that works. Default: 115200")
+    parser.add_argument('-f', '--fast', action='store_true', help="Load the program with one MEM_WRITE command per block of about 50 ms of data, each checked before the next is sent, instead of one WRITE per word.")
     args = parser.parse_args()
 
     spm_base = 0x10006000
@@ -215,11 +215,7 @@ def main():
     time.sleep(1)
 
     pcm = Pcm(args.port, baudrate=args.baudrate, debug=False, verbose=verbose, spm_base=spm_base)
-    if args.baudrate_next != args.baudrate:
-        print("Switching to baudrate to {}...".format(args.baudrate_next))
-        pcm.setbaud(args.baudrate_next)
-
-        pcm = Pcm(args.port, baudrate=args.baudrate_next, debug=False, verbose=verbose, spm_base=spm_base)
+    pcm.apply_baudrate_arg(args.baudrate, args.baudrate_next)
 
     pcm.pcm_reset()
 
@@ -228,7 +224,7 @@ def main():
     program += instr_set_reg(2, 0xcafef00d)
     program += instr_loop_forever(program)
 
-    pcm.im_load(0x00108000, program)
+    pcm.im_load(0x00108000, program, fast=args.fast)
 
     print("Before:")
     pcm.print_regs()
@@ -20,7 +20,10 @@
 
 
 import argparse
+import bisect
+import gzip
 import io
+import pickle
 import struct
 import time
 from copy import copy
@@ -28,7 +31,7 @@ from copy import copy
 from unicorn import *
 from unicorn.arm_const import *
 
-from bmo import Bmo
+from bmo import Bmo, baudrate_arg
 from openocd import OpenOcd
 
 
@@ -278,6 +281,14 @@ class BmOcd:
     def setbaud(self, *args, **kwargs):
         print("Warning: setbaud not supported for BmOcd.")
 
+    vector_poll_limit = Bmo.vector_poll_limit
+
+    def vector(self, records):
+        '''Run a list of register operations one word at a time, like
+        Bmo.vector().
+        '''
+        return Bmo._vector_fallback(self, records)
+
     def memory_read(self, addr, count, fast=False, print_speed=False):
         '''Read a range of memory to a byte array.
 
@@ -302,48 +313,458 @@ class BmOcd:
 
         return data
 
+    def memory_write(self, addr, data, fast=False, print_speed=False):
+        '''Write a byte array to a range of memory, like Bmo.memory_write().'''
+        data = bytes(data)
+        if len(data) % 4:
+            data += b'\0' * (4 - len(data) % 4)
+        for i in range(0, len(data), 4):
+            self.writew(addr + i, struct.unpack_from('<I', data, i)[0])
+
+    def memory_read_chunks(self, addr, count, fast=False, chunk_size=0x1000):
+        '''Read a range of memory a chunk at a time, like Bmo.memory_read_chunks().'''
+        for offset in range(0, count, chunk_size):
+            yield (addr + offset, self.memory_read(addr + offset, min(chunk_size, count - offset)))
+
+
+# size: (C type, struct format, value format)
+ACCESS_FORMATS = {
+    1: ("uint8_t", struct.Struct('B'), '0x{:02x}'.format),
+    2: ("uint16_t", struct.Struct('<H'), '0x{:04x}'.format),
+    4: ("uint32_t", struct.Struct('<I'), '0x{:08x}'.format),
+}
+
+# Instructions to skip in every SoC's preloader, like each SoC's brom_skip.
+PRELOADER_SKIP = {
+    # Skip mrrc/mcrr instructions.
+    0x00201080: 0x10,
+}
+
+# Instructions where the preloader's timeouts are patched to be at least 1
+# second.
+TIMEOUT_PATCHES = (
+    0x00212a6a,
+    0x0021a7e2,
+)
+
+# Block trace file format: BLOCK_TRACE_MAGIC, followed by a record with the
+# address and size of each basic block, in the order they were executed.
+BLOCK_TRACE_MAGIC = b'SOCBLKT\x01'
+BLOCK_RECORD = struct.Struct('<II')
+
+# Snapshot file format: a gzip-compressed SNAPSHOT_MAGIC, followed by a
+# pickled dict of the machine state.
+SNAPSHOT_MAGIC = b'SOCSNAP\x01'
+
+# The types of regions whose accesses are passed through to the hardware.
+PASSTHROUGH_TYPES = (
+    "MMIO",
+    "DRAM",
+)
+
+# How Passthrough treats the registers every SoC has. A SoC's
+# register_policy adds to and overrides these.
+CHIP_ID_POLICY = {
+    # Chip ID and version registers.
+    0x08000000: "static",
+    0x08000004: "static",
+    0x08000008: "static",
+    0x0800000c: "static",
+}
+
+
+class Passthrough:
+    '''Passes emulated MMIO and DRAM accesses through to the hardware, with
+    as few serial round trips as it can.
+
+    Registers marked "static" in CHIP_ID_POLICY or the SoC's
+    register_policy never change, so they're only read once. Other
+    registers are read every time they're accessed, and writes to
+    them are posted: they're queued, with consecutive writes to different
+    bytes of the same word merged into one, and sent in a single VECTOR
+    command before the next read that isn't answered from the cache, so
+    the hardware still sees every write in order, before any read that
+    could depend on it.
+
+    DRAM is cached a page at a time in the emulator's own memory: each page
+    is read from the hardware the first time it's accessed, and the words
+    written to it are written back when the posted MMIO writes are sent.
+    A DRAM write that follows a posted MMIO write sends the queue first,
+    so the written-back DRAM always comes before the MMIO writes still
+    queued, just as the emulated code did them.
+    This assumes nothing but the emulated CPU changes DRAM, so turn caching
+    off for code like DRAM calibration that depends on what the hardware
+    actually stores.
+
+    mu: The Unicorn instance.
+    bmo: The Bmo or BmOcd to pass accesses through to.
+    soc: The SoC's entry in SOCS.
+    cache: Whether to cache and post anything at all. If False, every
+           access goes straight to the hardware.
+    '''
+
+    dram_page_size = 0x1000
+
+    # The most posted writes to queue before sending them.
+    max_pending_writes = 64
+
+    def __init__(self, mu, bmo, soc, cache=True):
+        self.mu = mu
+        self.bmo = bmo
+        self.cache = cache
+        self.policy = {**CHIP_ID_POLICY, **soc.get('register_policy', {})}
+        self.static = {}
+        self.pending = []
+        self.dram_pages = set()
+        self.dram_dirty = set()
+
+    def readw(self, addr):
+        '''Read an MMIO register.'''
+        if not self.cache:
+            return self.bmo.readw(addr)
+
+        word = self.static.get(addr)
+        if word is not None:
+            return word
+
+        self.flush()
+        word = self.bmo.readw(addr)
+        if self.policy.get(addr) == "static":
+            self.static[addr] = word
+
+        return word
+
+    def writew(self, addr, word, mask=0xffffffff):
+        '''Write the bits of an MMIO register that are set in mask.'''
+        if not self.cache:
+            if mask == 0xffffffff:
+                self.bmo.writew(addr, word)
+            else:
+                self.bmo.vector([('modify', addr, word, mask)])
+            return
+
+        self.static.pop(addr, None)
+        # Only merge writes to different bits of the same register, like the
+        # byte writes of a wider store. Writing the same bits twice has to
+        # reach the hardware twice.
+        if self.pending and self.pending[-1][0] == addr and not (self.pending[-1][2] & mask):
+            last = self.pending[-1]
+            last[1] = (last[1] & ~mask) | (word & mask)
+            last[2] |= mask
+        else:
+            self.pending.append([addr, word & mask, mask])
+
+        if len(self.pending) >= self.max_pending_writes:
+            self.flush()
+
+    def _load_dram_page(self, addr):
+        page = addr & ~(self.dram_page_size - 1)
+        if page in self.dram_pages:
+            return
+        self.flush()
+        self.mu.mem_write(page, self.bmo.memory_read(page, self.dram_page_size, fast=True))
+        self.dram_pages.add(page)
+
+    def read(self, rtype, addr, size):
+        '''Update the emulator's memory with the data an access is about to
+        read from the hardware.
+        '''
+        if rtype == "DRAM" and self.cache:
+            self._load_dram_page(addr)
+            return
+
+        aligned_addr = addr & ~3
+        addr_offset = addr % 4
+        aligned_data = struct.pack('<I', self.readw(aligned_addr))
+        self.mu.mem_write(addr, aligned_data[addr_offset:addr_offset+size])
+
+    def write(self, rtype, addr, size, value):
+        '''Pass an access that writes to the hardware through.'''
+        if rtype == "DRAM" and self.cache:
+            # The page has to be loaded first so the rest of it isn't lost.
+            self._load_dram_page(addr)
+            # Write-back puts DRAM before the queued MMIO writes, so send
+            # those first, e.g., in case one of them hands a buffer over to
+            # the CPU that this write then fills in.
+            if self.pending:
+                self.flush()
+            self.dram_dirty.add(addr & ~3)
+            return
+
+        shift = (addr % 4) * 8
+        mask = ((1 << (size * 8)) - 1) << shift
+        self.writew(addr & ~3, value << shift, mask)
+
+    def flush(self):
+        '''Send the written DRAM words and the posted MMIO writes to the
+        hardware.
+        '''
+        # Every dirty DRAM word was written before every queued MMIO write,
+        # so write DRAM back first.
+        start = None
+        for addr in sorted(self.dram_dirty):
+            if start is None:
+                start = end = addr
+            elif addr == end + 4:
+                end = addr
+            else:
+                self.bmo.memory_write(start, self.mu.mem_read(start, end + 4 - start), fast=True)
+                start = end = addr
+        if start is not None:
+            self.bmo.memory_write(start, self.mu.mem_read(start, end + 4 - start), fast=True)
+        self.dram_dirty.clear()
+
+        if not self.pending:
+            return
+
+        records = []
+        for (addr, word, mask) in self.pending:
+            if mask == 0xffffffff:
+                records.append(('write', addr, word, mask))
+            else:
+                records.append(('modify', addr, word, mask))
+        self.pending = []
+        self.bmo.vector(records)
+
+
+class Snapshotter:
+    '''Saves the state of an emulation to a snapshot file, and restores it.
+
+    A snapshot has the CPU context, the contents of every RAM region, the
+    pages of MMIO and DRAM the emulation has touched, the virtual UART
+    buffers, and the passthrough caches. It doesn't have the state of the
+    hardware accesses were passed through to, so when resuming with a
+    device attached, it needs to be in the state it was in when the
+    snapshot was taken.
+
+    The CPU context is saved the way Unicorn saves it, so snapshots can only
+    be restored with the same version of Unicorn.
+
+    Snapshots are pickles, and loading a pickle can run arbitrary code, so
+    only restore snapshots from a source you trust, like your own.
+
+    soc_name: The SoC's name in SOCS.
+    passthrough: The Passthrough, or None if there isn't one.
+    '''
+
+    page_size = 0x1000
+
+    def __init__(self, mu, soc_name, passthrough=None):
+        self.mu = mu
+        self.soc_name = soc_name
+        self.soc = SOCS[soc_name]
+        self.passthrough = passthrough
+        self.address_map = AddressMap(self.soc)
+        self.touched_pages = set()
+        self.breakpoint_taken = False
+
+    def touch(self, addr, size=1):
+        '''Include the pages of a range of MMIO or DRAM in snapshots.'''
+        for page in range(addr & ~(self.page_size - 1), addr + size, self.page_size):
+            self.touched_pages.add(page)
+
+    def save(self, path, exitpoint):
+        print("Saving snapshot to {}...".format(path))
+        if self.passthrough:
+            self.passthrough.flush()
+
+        memory = []
+        for region in self.soc['regions']:
+            base = region['base']
+            size = region['size']
+            if region['type'] not in PASSTHROUGH_TYPES:
+                memory.append((base, bytes(self.mu.mem_read(base, size))))
+                continue
+            for page in sorted(self.touched_pages):
+                if base <= page < base + size:
+                    memory.append((page, bytes(self.mu.mem_read(page, self.page_size))))
+
+        state = {
+            'soc': self.soc_name,
+            'context': self.mu.context_save(),
+            'exitpoint': exitpoint,
+            'memory': memory,
+            'uart_buffers': {pname: pinfo['buffer'].getvalue() for (pname, pinfo) in self.soc['peripherals'].items() if 'buffer' in pinfo},
+            'passthrough': None,
+        }
+        if self.passthrough:
+            state['passthrough'] = {
+                'static': self.passthrough.static,
+                'dram_pages': self.passthrough.dram_pages,
+            }
+
+        snapshot_file = gzip.open(path, 'wb')
+        snapshot_file.write(SNAPSHOT_MAGIC)
+        pickle.dump(state, snapshot_file)
+        snapshot_file.close()
+
+    def restore(self, path):
+        '''Restore a snapshot, and return the (address to resume at, exit
+        point) it was saved with.
+
+        Only restore snapshots you trust: they're unpickled, which can run
+        arbitrary code.
+        '''
+        print("Restoring snapshot from {}...".format(path))
+        snapshot_file = gzip.open(path, 'rb')
+        if snapshot_file.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ValueError("{} is not a snapshot file.".format(path))
+        state = pickle.load(snapshot_file)
+        snapshot_file.close()
+
+        if state['soc'] != self.soc_name:
+            raise ValueError("{} is a snapshot of {}, not {}.".format(path, state['soc'], self.soc_name))
+
+        for (addr, data) in state['memory']:
+            self.mu.mem_write(addr, data)
+            if self.address_map.lookup(addr)[0] in PASSTHROUGH_TYPES:
+                self.touch(addr, len(data))
+
+        for (pname, data) in state['uart_buffers'].items():
+            uart_buf = io.BytesIO(data)
+            uart_buf.seek(0, io.SEEK_END)
+            self.soc['peripherals'][pname]['buffer'] = uart_buf
+
+        if self.passthrough and state['passthrough']:
+            self.passthrough.static = state['passthrough']['static']
+            self.passthrough.dram_pages = state['passthrough']['dram_pages']
+
+        self.mu.context_restore(state['context'])
+        pc = self.mu.reg_read(UC_ARM_REG_PC)
+        if self.mu.reg_read(UC_ARM_REG_CPSR) & (1 << 5):
+            # Resume in Thumb mode.
+            pc |= 1
+
+        return (pc, state['exitpoint'])
+
 
 def memory_region(address, size):
     return range(address, address+size)
 
+class AddressMap:
+    '''The regions and peripherals of a SoC, compiled into a sorted list of
+    non-overlapping address ranges that can be searched with bisect.
+
+    Where regions overlap, the first one listed wins, and likewise for
+    peripherals, so lookups give the same answers as checking each region
+    and peripheral in order.
+    '''
+
+    def __init__(self, soc):
+        regions = [(region['base'], region['base'] + region['size'], region['type']) for region in soc['regions']]
+        peripherals = [(pinfo['base'], pinfo['base'] + pinfo['size'], (pname, pinfo)) for (pname, pinfo) in soc['peripherals'].items()]
+
+        bounds = sorted(set(bound for (start, end, _) in regions + peripherals for bound in (start, end)))
+
+        self.starts = []
+        self.entries = []
+        for (start, end) in zip(bounds, bounds[1:]):
+            rtype = next((rtype for (rstart, rend, rtype) in regions if rstart <= start < rend), None)
+            peripheral = next((peripheral for (pstart, pend, peripheral) in peripherals if pstart <= start < pend), (None, None))
+            if rtype is None and peripheral[0] is None:
+                continue
+
+            entry = (end, rtype or "MMIO", peripheral[0], peripheral[1])
+            if self.entries and self.entries[-1][0] == start and self.entries[-1][1:] == entry[1:]:
+                # Merge with the previous range.
+                self.entries[-1] = entry
+                continue
+
+            self.starts.append(start)
+            self.entries.append(entry)
+
+    def lookup(self, addr):
+        '''Return the (region type, peripheral name, peripheral info) of an
+        address. Addresses outside every region are treated as MMIO, and the
+        peripheral name and info are None for addresses outside every
+        peripheral.
+        '''
+        index = bisect.bisect_right(self.starts, addr) - 1
+        if index >= 0:
+            (end, rtype, pname, pinfo) = self.entries[index]
+            if addr < end:
+                return (rtype, pname, pinfo)
+        return ("MMIO", None, None)
+
+def hooked_ranges(soc):
+    '''Return the (begin, end) address ranges, inclusive, that hook_mmio
+    needs to see accesses to: the regions that are passed through to the
+    hardware, the peripherals, and the masked registers. Overlapping and
+    adjacent ranges are merged, so no access is hooked twice.
+    '''
+    ranges = [(region['base'], region['base'] + region['size']) for region in soc['regions'] if region['type'] in PASSTHROUGH_TYPES]
+    ranges += [(pinfo['base'], pinfo['base'] + pinfo['size']) for pinfo in soc['peripherals'].values()]
+    ranges += [(addr, addr + 4) for addr in soc.get('masked_registers', {})]
+
+    merged = []
+    for (start, end) in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    return [(start, end - 1) for (start, end) in merged]
+
+def address_range(value):
+    '''Parse an inclusive address range argument, START[-END].'''
+    (start, _, end) = value.partition('-')
+    start = int(start, 0)
+    end = int(end, 0) if end else start
+    if end < start:
+        raise argparse.ArgumentTypeError("Range ends before it starts: {}".format(value))
+    return (start, end)
+
+def read_block_trace(path):
+    '''Yield the (address, size) of each basic block in a block trace file,
+    in the order they were executed.
+    '''
+    trace_file = open(path, 'rb')
+    if trace_file.read(len(BLOCK_TRACE_MAGIC)) != BLOCK_TRACE_MAGIC:
+        raise ValueError("{} is not a block trace file.".format(path))
+
+    while True:
+        record = trace_file.read(BLOCK_RECORD.size)
+        if len(record) < BLOCK_RECORD.size:
+            break
+        yield BLOCK_RECORD.unpack(record)
+
+    trace_file.close()
+
 def hook_code(mu, addr, size, user_data):
     print('>>> Tracing instruction at 0x{:08x}, instruction size = {}'.format(addr, size))
 
-    soc = user_data
-
-    if addr in soc.get('brom_skip', {}).keys():
-        skip_len = soc['brom_skip'][addr]
-        mu.reg_write(UC_ARM_REG_PC, addr + skip_len)
+def hook_snapshot(mu, addr, size, user_data):
+    (snapshotter, path, exitpoint) = user_data
+    if snapshotter.breakpoint_taken:
         return
+    snapshotter.breakpoint_taken = True
+    snapshotter.save(path, exitpoint)
 
-    # Skip mrrc/mcrr instructions.
-    if addr == 0x00201080:
-        mu.reg_write(UC_ARM_REG_PC, addr + 0x10)
+def hook_block(mu, addr, size, trace_file):
+    trace_file.write(BLOCK_RECORD.pack(addr, size))
+
+def hook_skip(mu, addr, size, skip_len):
+    mu.reg_write(UC_ARM_REG_PC, addr + skip_len)
 
-    # Patch all timeouts to be at least 1 second.
-    if addr in (0x00212a6a, 0x0021a7e2):
-        r5 = mu.reg_read(UC_ARM_REG_R5)
-        if (r5 / 13000000) < 1:
-            r5 = 1 * 13000000
-        mu.reg_write(UC_ARM_REG_R5, r5)
+def hook_timeout(mu, addr, size, user_data):
+    # Patch the timeout to be at least 1 second.
+    r5 = mu.reg_read(UC_ARM_REG_R5)
+    if (r5 / 13000000) < 1:
+        r5 = 1 * 13000000
+    mu.reg_write(UC_ARM_REG_R5, r5)
 
 def hook_mmio(mu, access, addr, size, value, user_data):
-    (soc, bmo) = user_data
+    (soc, passthrough, address_map, snapshotter) = user_data
 
-    rtype = "MMIO"
-    for region in soc['regions']:
-        if addr in memory_region(region['base'], region['size']):
-            rtype = region['type']
-            break
+    (rtype, pname, pinfo) = address_map.lookup(addr)
+
+    if snapshotter:
+        snapshotter.touch(addr, size)
 
     # Peripheral handler
-    for peripheral in soc['peripherals'].items():
-        (pname, pinfo) = peripheral
+    if pinfo is not None:
         base = pinfo['base']
 
-        if addr not in memory_region(base, pinfo['size']):
-            continue
-
         if pinfo['type'] == "UART":
             if addr == (base + 0x14) and access == UC_MEM_READ:
                 mu.mem_write(addr, struct.pack('<I', (1 << 6) | (1 << 5)))
@@ -374,13 +795,12 @@ def hook_mmio(mu, access, addr, size, value, user_data):
                 return
 
     # Masked register accesses.
-    masks = soc.get('masked_registers', {})
-    if addr in masks.keys() and access == UC_MEM_WRITE and bmo:
-        mask = masks[addr]
+    mask = soc.get('masked_registers', {}).get(addr)
+    if mask is not None and access == UC_MEM_WRITE and passthrough:
         orig = copy(value)
         new = copy(value)
         new &= (~mask) & 0xffffffff
-        new |= bmo.readw(addr) & mask
+        new |= passthrough.readw(addr) & mask
         diff = orig ^ new
         if diff != 0:
             value = new
@@ -389,48 +809,22 @@ def hook_mmio(mu, access, addr, size, value, user_data):
 
     assert size <= 4
 
-    dtype = {
-        1: "uint8_t",
-        2: "uint16_t",
-        4: "uint32_t",
-        8: "uint64_t",
-    }.get(size)
-    dfmt = {
-        1: 'B',
-        2: '<H',
-        4: '<I',
-    }.get(size)
-    dstr = {
-        1: '0x{:02x}',
-        2: '0x{:04x}',
-        4: '0x{:08x}',
-    }.get(size)
-
-
-    aligned_addr = (addr // 4) * 4
-    addr_offset = addr % 4
-    assert (addr_offset + size) <= 4
-
-    rw_through = (
-        "MMIO",
-        "DRAM",
-    )
+    (dtype, dfmt, dstr) = ACCESS_FORMATS[size]
+
+    assert ((addr % 4) + size) <= 4
+
     if access == UC_MEM_READ:
-        if bmo and rtype in rw_through:
-            aligned_data = struct.pack('<I', bmo.readw(aligned_addr))
-            data = aligned_data[addr_offset:addr_offset+size]
-            mu.mem_write(addr, data)
+        if passthrough and rtype in PASSTHROUGH_TYPES:
+            passthrough.read(rtype, addr, size)
         data_bytes = mu.mem_read(addr, size)
-        data_int = struct.unpack(dfmt, data_bytes)[0]
-        data_str = dstr.format(data_int)
+        data_int = dfmt.unpack(data_bytes)[0]
+        data_str = dstr(data_int)
         print("{} read: *({} *)(0x{:08x}) = {}".format(rtype, dtype, addr, data_str))
     elif access == UC_MEM_WRITE:
-        data_str = dstr.format(value)
+        data_str = dstr(value)
         print("{} write: *({} *)(0x{:08x}) = {}".format(rtype, dtype, addr, data_str))
-        if bmo and rtype in rw_through:
-            aligned_data = bytearray(struct.pack('<I', bmo.readw(aligned_addr)))
-            aligned_data[addr_offset:addr_offset+size] = struct.pack('<I', value)[:size]
-            bmo.writew(aligned_addr, struct.unpack('<I', aligned_data)[0])
+        if passthrough and rtype in PASSTHROUGH_TYPES:
+            passthrough.write(rtype, addr, size, value)
 
 def hook_unmapped(mu, access, addr, size, value, user_data):
     access_string = {
@@ -442,31 +836,43 @@ def hook_unmapped(mu, access, addr, size, value, user_data):
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('binary', type=str, help="The binary you want to load.")
+    parser.add_argument('binary', type=str, nargs='?', help="The binary you want to load. Not needed when restoring a snapshot.")
     parser.add_argument('-S', '--soc', type=str, choices=SOCS.keys(), default="MT6737M", help="The SoC you want to emulate. Default: MT6737M")
     parser.add_argument('-l', '--load-address', type=str, default="0", help="The address you want to load the binary at. Default: 0")
     parser.add_argument('-e', '--entrypoint', type=str, default="0", help="The address you want to start executing from (add 1 for Thumb mode). Default: 0")
     parser.add_argument('-E', '--exitpoint', type=str, help="The address you want to stop executing at.")
     parser.add_argument('-p', '--port', type=str, help="The BMO serial port you want to connect to.")
     parser.add_argument('-b', '--baudrate', type=int, default=115200, help="The baud rate you want to connect at. Default: 115200")
-    parser.add_argument('-s', '--baudrate-next', type=int, default=115200, help="The baud rate you want to switch to. Default: 115200")
+    parser.add_argument('-s', '--baudrate-next', type=baudrate_arg, default=115200, help="The baud rate you want to switch to, or \"auto\" to use the fastest one that works. Default: 115200")
     parser.add_argument('-O', '--openocd', type=str, help="The OpenOCD address and port you want to connect to.")
+    parser.add_argument('-t', '--trace-code', type=address_range, action='append', default=[], metavar="START[-END]", help="Print each instruction executed in this range of addresses. Can be specified multiple times. Use 0-0xffffffff to trace everything.")
+    parser.add_argument('-T', '--trace-blocks', type=str, help="Write the address and size of each basic block executed to this file.")
+    parser.add_argument('-c', '--no-cache', action='store_true', help="Pass every MMIO and DRAM access straight through to the hardware, without caching or posting any of them.")
+    parser.add_argument('-m', '--trace-memory', action='store_true', help="Hook and print every memory access, not just the ones to MMIO, DRAM, and peripherals.")
+    parser.add_argument('-r', '--restore', type=str, help="Resume from this snapshot instead of loading the binary.")
+    parser.add_argument('-w', '--snapshot', type=str, help="Save a snapshot to this file when the emulator stops, or at the snapshot address.")
+    parser.add_argument('-a', '--snapshot-at', type=str, help="Save the snapshot when execution reaches this address, then keep going.")
     args = parser.parse_args()
 
     assert not (args.port and args.openocd)
+    assert args.binary or args.restore
+    assert args.snapshot or not args.snapshot_at
 
     soc = SOCS[args.soc]
 
-    # Read the binary.
-    binary = open(args.binary, 'rb').read()
-    bin_size = len(binary)
+    binary = None
+    exitpoint = None
+    if not args.restore:
+        # Read the binary.
+        binary = open(args.binary, 'rb').read()
+        bin_size = len(binary)
 
-    # Make sure the entrypoint is within the bounds of the loaded binary.
-    load_addr = int(args.load_address, 0)
-    entrypoint = int(args.entrypoint, 0)
-    assert entrypoint in memory_region(load_addr, bin_size)
+        # Make sure the entrypoint is within the bounds of the loaded binary.
+        load_addr = int(args.load_address, 0)
+        entrypoint = int(args.entrypoint, 0)
+        assert entrypoint in memory_region(load_addr, bin_size)
 
-    exitpoint = load_addr + bin_size
+        exitpoint = load_addr + bin_size
     if args.exitpoint:
         exitpoint = int(args.exitpoint, 0)
 
@@ -474,11 +880,7 @@ def main():
     if args.port:
         print("Initializing BMO...")
         bmo = Bmo(args.port, baudrate=args.baudrate, debug=False)
-        if args.baudrate_next != args.baudrate:
-            print("Switching to baudrate to {}...".format(args.baudrate_next))
-            bmo.setbaud(args.baudrate_next)
-
-            bmo = Bmo(args.port, baudrate=args.baudrate_next, debug=False)
+        bmo.apply_baudrate_arg(args.baudrate, args.baudrate_next)
     elif args.openocd:
         address, port = args.openocd.split(":")
         bmo = BmOcd(address, int(port), debug=False)
@@ -496,10 +898,13 @@ def main():
         mu.mem_map(base, size)
 
         # Optionally load region from SoC.
-        if bmo and region.get('load', False):
+        if bmo and region.get('load', False) and not args.restore:
             print("Loading {} from SoC...".format(rtype))
-            data = bmo.memory_read(base, size, fast=True, print_speed=True)
-            mu.mem_write(base, data)
+            start_ns = time.perf_counter_ns()
+            for (chunk_addr, data) in bmo.memory_read_chunks(base, size, fast=True):
+                mu.mem_write(chunk_addr, data)
+            elapsed = max(time.perf_counter_ns() - start_ns, 1)
+            print("Read {} bytes in {:.6f} seconds ({} bytes per second).".format(size, elapsed/1000000000, size*1000000000//elapsed))
 
     # Initialize peripherals.
     for (pname, pinfo) in soc['peripherals'].items():
@@ -507,13 +912,61 @@ def main():
             # Virtual UART
             pinfo['buffer'] = io.BytesIO()
 
-    # Load and execute the binary.
-    mu.mem_write(load_addr, binary)
-    mu.hook_add(UC_HOOK_CODE, hook_code, soc)
-    mu.hook_add(UC_HOOK_MEM_READ | UC_HOOK_MEM_WRITE, hook_mmio, (soc, bmo))
+    passthrough = None
+    if bmo:
+        passthrough = Passthrough(mu, bmo, soc, cache=not args.no_cache)
+    snapshotter = None
+    if args.snapshot or args.restore:
+        snapshotter = Snapshotter(mu, args.soc, passthrough)
+
+    # Load the binary, or restore the snapshot.
+    if args.restore:
+        (entrypoint, snapshot_exitpoint) = snapshotter.restore(args.restore)
+        if exitpoint is None:
+            exitpoint = snapshot_exitpoint
+    else:
+        mu.mem_write(load_addr, binary)
+        if snapshotter:
+            snapshotter.touch(load_addr, bin_size)
+
+    for (begin, end) in args.trace_code:
+        mu.hook_add(UC_HOOK_CODE, hook_code, None, begin, end)
+    trace_file = None
+    if args.trace_blocks:
+        trace_file = open(args.trace_blocks, 'wb')
+        trace_file.write(BLOCK_TRACE_MAGIC)
+        mu.hook_add(UC_HOOK_BLOCK, hook_block, trace_file)
+
+    # Hook only the instructions that need patching, so the rest run without
+    # leaving Unicorn.
+    skips = dict(PRELOADER_SKIP)
+    skips.update(soc.get('brom_skip', {}))
+    for (addr, skip_len) in skips.items():
+        mu.hook_add(UC_HOOK_CODE, hook_skip, skip_len, addr, addr)
+    for addr in TIMEOUT_PATCHES:
+        mu.hook_add(UC_HOOK_CODE, hook_timeout, None, addr, addr)
+    if args.snapshot_at:
+        addr = int(args.snapshot_at, 0) & ~1
+        mu.hook_add(UC_HOOK_CODE, hook_snapshot, (snapshotter, args.snapshot, exitpoint), addr, addr)
+    mmio_data = (soc, passthrough, AddressMap(soc), snapshotter)
+    if args.trace_memory:
+        mu.hook_add(UC_HOOK_MEM_READ | UC_HOOK_MEM_WRITE, hook_mmio, mmio_data)
+    else:
+        # Only hook the ranges that need it, so accesses to plain RAM don't
+        # leave Unicorn.
+        for (begin, end) in hooked_ranges(soc):
+            mu.hook_add(UC_HOOK_MEM_READ | UC_HOOK_MEM_WRITE, hook_mmio, mmio_data, begin, end)
     mu.hook_add(UC_HOOK_MEM_UNMAPPED, hook_unmapped)
     print("Starting emulator!")
-    mu.emu_start(entrypoint, exitpoint)
+    try:
+        mu.emu_start(entrypoint, exitpoint)
+    finally:
+        if passthrough:
+            passthrough.flush()
+        if args.snapshot and not args.snapshot_at:
+            snapshotter.save(args.snapshot, exitpoint)
+        if trace_file is not None:
+            trace_file.close()
 
 if __name__ == "__main__":
     main()
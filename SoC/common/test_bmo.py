@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# test_bmo.py - Tests for the Binary MOde protocol client, run against the
+# simulated serial monitor.
+# Copyright (C) 2019-2021  Forest Crossman <cyrozap@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import unittest
+
+import bmo_sim
+from bmo import Bmo
+from transport import LoopbackTransport
+
+
+class VectorPollTest(unittest.TestCase):
+    addr = 0x10000058
+
+    def _poll(self, vector, values):
+        transport = bmo_sim.loopback_transport(vector=vector)
+        transport.sim.registers[self.addr] = values
+        bmo = Bmo(None, transport=transport)
+        (ready, after) = bmo.vector([
+            ('poll', self.addr, 0, 0xffffffff),
+            ('read', self.addr, 0, 0),
+        ])
+        return (ready, after, transport.sim.registers[self.addr])
+
+    def test_poll_waits_while_equal(self):
+        for vector in (True, False):
+            with self.subTest(vector=vector):
+                (ready, after, left) = self._poll(vector, [0, 0, 0, 1, 2])
+                self.assertEqual(ready, 1)
+                self.assertEqual(after, 2)
+                self.assertEqual(left, [2])
+
+    def test_poll_returns_at_once_when_different(self):
+        for vector in (True, False):
+            with self.subTest(vector=vector):
+                (ready, after, left) = self._poll(vector, [5, 6])
+                self.assertEqual(ready, 5)
+                self.assertEqual(after, 6)
+
+    def test_poll_gives_up(self):
+        transport = bmo_sim.loopback_transport()
+        transport.sim.registers[self.addr] = [0]
+        bmo = Bmo(None, transport=transport)
+        # The simulator shares the limit, so lower it for both.
+        (limit, Bmo.vector_poll_limit) = (Bmo.vector_poll_limit, 16)
+        try:
+            self.assertEqual(bmo.vector([('poll', self.addr, 0, 0xffffffff)]), [0])
+        finally:
+            Bmo.vector_poll_limit = limit
+
+
+class VerifiedWriteTest(unittest.TestCase):
+    addr = 0x00100000
+    data = bytes(range(256)) * 32
+
+    def _write_dropping_a_byte(self, checksum):
+        sim = bmo_sim.BmoSimulator(checksum=checksum)
+        armed = []
+        dropped = []
+
+        # Once armed, lose a byte from the next MEM_WRITE payload, leaving
+        # the monitor short of data when the check is sent.
+        def process(data):
+            if armed and not dropped and len(data) > 100:
+                dropped.append(data[50])
+                data = data[:50] + data[51:]
+            return sim.process(data)
+
+        bmo = Bmo(None, transport=LoopbackTransport(process))
+        # Write once cleanly, so the CHECKSUM probe is out of the way.
+        bmo.memory_write(self.addr, bytes(len(self.data)), fast=True, verify=True)
+        armed.append(True)
+        bmo.memory_write(self.addr, self.data, fast=True, verify=True)
+        self.assertTrue(dropped)
+        self.assertEqual(bmo.checksum_supported, checksum)
+        self.assertEqual(bmo.memory_read(self.addr, len(self.data), fast=True), self.data)
+
+    def test_lost_byte_is_resent(self):
+        for checksum in (True, False):
+            with self.subTest(checksum=checksum):
+                self._write_dropping_a_byte(checksum)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# test_usbdl.py - Tests for the BROM USB DL protocol client's helpers.
+# Copyright (C) 2019-2021  Forest Crossman <cyrozap@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import random
+import struct
+import unittest
+from unittest import mock
+
+import usbdl
+from usbdl import XorChecksum, xor16
+
+
+def naive_xor16(data):
+    checksum = 0
+    for offset in range(0, len(data), 2):
+        checksum ^= struct.unpack_from('<H', data, offset)[0]
+    return checksum
+
+
+class Xor16Test(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(0x1234)
+        self.data = bytes(rng.randrange(256) for i in range(0x1001))
+
+    def _check_xor16(self):
+        # Cover lengths of 0 and 2 mod 4, which the fold handles differently.
+        for length in (0, 2, 4, 6, 8, 10, 0x3e, 0x40, 0x402, 0x1000):
+            with self.subTest(length=length):
+                data = self.data[:length]
+                self.assertEqual(xor16(data), naive_xor16(data))
+
+    def test_xor16_fold(self):
+        with mock.patch.object(usbdl, 'numpy', None):
+            self._check_xor16()
+
+    def test_xor16_numpy(self):
+        if usbdl.numpy is None:
+            self.skipTest("numpy is not installed")
+        self._check_xor16()
+
+    def test_update_odd_chunks(self):
+        data = self.data[:0x400]
+        expected = naive_xor16(data)
+        for splits in ((1, 0x3ff), (3, 5, 7, 0x3f1), (1,) * 0x400, (0, 0x201, 0, 0x1ff)):
+            with self.subTest(splits=splits[:4]):
+                checksum = XorChecksum()
+                offset = 0
+                for length in splits:
+                    checksum.update(data[offset:offset+length])
+                    offset += length
+                self.assertEqual(checksum.value(), expected)
+
+    def test_value_pads_odd_length(self):
+        for length in (1, 3, 0x401):
+            with self.subTest(length=length):
+                data = self.data[:length]
+                self.assertEqual(XorChecksum(data).value(), naive_xor16(data + b'\0'))
+
+        checksum = XorChecksum(self.data[:5])
+        checksum.update(self.data[5:9])
+        self.assertEqual(checksum.value(), naive_xor16(self.data[:9] + b'\0'))
+
+
+if __name__ == "__main__":
+    unittest.main()
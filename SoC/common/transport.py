@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# transport.py - Byte transports for talking to SoCs in USB Download Mode.
+# Copyright (C) 2019-2021  Forest Crossman <cyrozap@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Every transport has the same interface as the subset of serial.Serial that
+# UsbDl uses: write(data), read(count), readinto(buf), and close(). Reads
+# return fewer bytes than requested if the timeout expires.
+
+
+import struct
+import time
+
+import serial
+
+try:
+    import usb.core
+    import usb.util
+except ImportError:
+    usb = None
+
+
+class TransportError(Exception):
+    pass
+
+
+class SerialTransport:
+    '''A transport that goes through the OS's CDC-ACM serial driver.'''
+
+    def __init__(self, port, timeout=1, write_timeout=1):
+        self.ser = serial.Serial(port, timeout=timeout, write_timeout=write_timeout)
+
+    def close(self):
+        self.ser.close()
+
+    def write(self, data):
+        return self.ser.write(data)
+
+    def read(self, count):
+        return self.ser.read(count)
+
+    def readinto(self, buf):
+        return self.ser.readinto(buf)
+
+
+class UsbTransport:
+    '''A transport that talks to the CDC data interface's bulk endpoints
+    directly with libusb, bypassing the tty layer.
+    '''
+
+    # MediaTek BROM USB DL mode.
+    default_vid = 0x0e8d
+    default_pid = 0x0003
+
+    def __init__(self, vid=None, pid=None, timeout=1, write_timeout=1, read_size=0x10000):
+        if usb is None:
+            raise TransportError("The libusb transport requires PyUSB.")
+
+        self.vid = vid if vid is not None else self.default_vid
+        self.pid = pid if pid is not None else self.default_pid
+        self.timeout_ms = int(timeout * 1000)
+        self.write_timeout_ms = int(write_timeout * 1000)
+        self.read_size = read_size
+        self.rx = bytearray()
+
+        try:
+            self.dev = usb.core.find(idVendor=self.vid, idProduct=self.pid)
+        except usb.core.NoBackendError as e:
+            raise TransportError(e)
+        if self.dev is None:
+            raise TransportError("No USB device with ID {:04x}:{:04x} found.".format(self.vid, self.pid))
+
+        try:
+            cfg = self.dev.get_active_configuration()
+        except usb.core.USBError:
+            self.dev.set_configuration()
+            cfg = self.dev.get_active_configuration()
+
+        # Take the device away from the cdc_acm driver, remembering which
+        # interfaces to give back when we're done.
+        self.detached = []
+        for intf in cfg:
+            if self.dev.is_kernel_driver_active(intf.bInterfaceNumber):
+                self.dev.detach_kernel_driver(intf.bInterfaceNumber)
+                self.detached.append(intf.bInterfaceNumber)
+
+        # Assert DTR and RTS, like the serial driver does when the port is
+        # opened.
+        comm_intf = usb.util.find_descriptor(cfg, bInterfaceClass=0x02)
+        if comm_intf is not None:
+            try:
+                self.dev.ctrl_transfer(0x21, 0x22, 0x3, comm_intf.bInterfaceNumber)
+            except usb.core.USBError:
+                pass
+
+        data_intf = usb.util.find_descriptor(cfg, bInterfaceClass=0x0A)
+        if data_intf is None:
+            raise TransportError("USB device {:04x}:{:04x} has no CDC data interface.".format(self.vid, self.pid))
+
+        def bulk_endpoint(direction):
+            return usb.util.find_descriptor(data_intf, custom_match=lambda e:
+                    usb.util.endpoint_direction(e.bEndpointAddress) == direction and
+                    usb.util.endpoint_type(e.bmAttributes) == usb.util.ENDPOINT_TYPE_BULK)
+
+        self.ep_out = bulk_endpoint(usb.util.ENDPOINT_OUT)
+        self.ep_in = bulk_endpoint(usb.util.ENDPOINT_IN)
+        if self.ep_out is None or self.ep_in is None:
+            raise TransportError("USB device {:04x}:{:04x} is missing a bulk endpoint.".format(self.vid, self.pid))
+
+    def close(self):
+        usb.util.dispose_resources(self.dev)
+        for interface in self.detached:
+            try:
+                self.dev.attach_kernel_driver(interface)
+            except usb.core.USBError:
+                # The device may have reset or gone away.
+                pass
+        self.detached = []
+
+    def write(self, data):
+        try:
+            return self.ep_out.write(bytes(data), self.write_timeout_ms)
+        except usb.core.USBError as e:
+            raise TransportError(e)
+
+    def _fill(self, count):
+        deadline = time.monotonic() + self.timeout_ms / 1000
+        while len(self.rx) < count:
+            remaining_ms = int((deadline - time.monotonic()) * 1000)
+            if remaining_ms <= 0:
+                break
+            try:
+                self.rx += self.ep_in.read(max(self.read_size, count - len(self.rx)), remaining_ms)
+            except usb.core.USBTimeoutError:
+                break
+            except usb.core.USBError as e:
+                raise TransportError(e)
+
+    def read(self, count):
+        self._fill(count)
+        data = bytes(self.rx[:count])
+        del self.rx[:count]
+        return data
+
+    def readinto(self, buf):
+        view = memoryview(buf).cast('B')
+        self._fill(len(view))
+        count = min(len(view), len(self.rx))
+        view[:count] = self.rx[:count]
+        del self.rx[:count]
+        return count
+
+
+class LoopbackTransport:
+    '''An in-process transport for testing.
+
+    device: A function that takes the bytes the host wrote and returns the
+            bytes the device sends in response. If it's None, everything
+            written is simply echoed back.
+    '''
+
+    def __init__(self, device=None):
+        self.device = device
+        self.rx = bytearray()
+
+    def close(self):
+        pass
+
+    def write(self, data):
+        data = bytes(data)
+        if self.device is None:
+            self.rx += data
+        else:
+            self.rx += self.device(data)
+        return len(data)
+
+    def read(self, count):
+        data = bytes(self.rx[:count])
+        del self.rx[:count]
+        return data
+
+    def readinto(self, buf):
+        view = memoryview(buf).cast('B')
+        count = min(len(view), len(self.rx))
+        view[:count] = self.rx[:count]
+        del self.rx[:count]
+        return count
+
+
+# Capture file format: CAPTURE_MAGIC, followed by one record per transfer: a
+# CAPTURE_RECORD header (direction, nanoseconds since the capture started,
+# length) and then the bytes that were transferred. Records are appended as
+# the transfers happen, so a capture of a session that crashed is still
+# usable up to the crash.
+CAPTURE_MAGIC = b'USBDLCAP\x01'
+CAPTURE_RECORD = struct.Struct('<BQI')
+CAPTURE_OUT = 0
+CAPTURE_IN = 1
+
+
+class CaptureTransport:
+    '''Wraps a transport and records everything written to and read from it,
+    with timestamps, to a capture file that ReplayTransport can play back.
+    '''
+
+    def __init__(self, transport, path):
+        self.transport = transport
+        self.capture_file = open(path, 'wb')
+        self.capture_file.write(CAPTURE_MAGIC)
+        self.start_ns = time.perf_counter_ns()
+
+    def __getattr__(self, name):
+        return getattr(self.transport, name)
+
+    def _record(self, direction, data):
+        self.capture_file.write(CAPTURE_RECORD.pack(direction, time.perf_counter_ns() - self.start_ns, len(data)))
+        self.capture_file.write(data)
+        # Hand each record to the OS right away, so the capture survives the
+        # tool crashing.
+        self.capture_file.flush()
+
+    def close(self):
+        self.transport.close()
+        self.capture_file.close()
+
+    def write(self, data):
+        count = self.transport.write(data)
+        self._record(CAPTURE_OUT, data)
+        return count
+
+    def read(self, count):
+        data = self.transport.read(count)
+        if data:
+            self._record(CAPTURE_IN, data)
+        return data
+
+    def readinto(self, buf):
+        count = self.transport.readinto(buf)
+        if count:
+            self._record(CAPTURE_IN, memoryview(buf).cast('B')[:count])
+        return count
+
+
+def read_capture(path):
+    '''Return a list of (direction, timestamp_ns, data) tuples for each
+    transfer in a capture file. A truncated last record is ignored.
+    '''
+    capture = open(path, 'rb').read()
+    if not capture.startswith(CAPTURE_MAGIC):
+        raise TransportError("{} is not a capture file.".format(path))
+
+    records = []
+    pos = len(CAPTURE_MAGIC)
+    while pos + CAPTURE_RECORD.size <= len(capture):
+        (direction, timestamp_ns, length) = CAPTURE_RECORD.unpack_from(capture, pos)
+        pos += CAPTURE_RECORD.size
+        if pos + length > len(capture):
+            break
+        records.append((direction, timestamp_ns, capture[pos:pos+length]))
+        pos += length
+
+    return records
+
+
+class ReplayTransport:
+    '''Plays a capture back to the host, in place of the device it was
+    captured from.
+
+    What the host writes is checked against what was captured, and each
+    captured response can be read once the host has written everything that
+    preceded it, so a session replays deterministically no matter how the
+    host splits up its transfers. If the host writes something different
+    from the capture, TransportError is raised. Reads that can't be satisfied
+    return short, like a serial port timing out.
+
+    path: The capture file to play back.
+    realtime: Deliver each response no earlier than it arrived in the
+              capture, relative to the first transfer, instead of as fast as
+              possible.
+    '''
+
+    def __init__(self, path, realtime=False):
+        self.realtime = realtime
+
+        records = read_capture(path)
+        self.first_timestamp_ns = records[0][1] if records else 0
+        out = []
+        out_count = 0
+        # (Number of bytes written before the response, timestamp, response)
+        self.responses = []
+        for (direction, timestamp_ns, data) in records:
+            if direction == CAPTURE_OUT:
+                out.append(data)
+                out_count += len(data)
+            else:
+                self.responses.append((out_count, timestamp_ns, data))
+        self.expected = b''.join(out)
+
+        self.written = 0
+        self.index = 0
+        self.offset = 0
+        self.clock_offset_ns = None
+
+    def close(self):
+        pass
+
+    def _start_clock(self):
+        if self.clock_offset_ns is None:
+            self.clock_offset_ns = time.perf_counter_ns() - self.first_timestamp_ns
+
+    def write(self, data):
+        self._start_clock()
+        data = bytes(data)
+        expected = self.expected[self.written:self.written+len(data)]
+        if data != expected:
+            raise TransportError("Replay diverged from the capture after {} bytes written: expected {}, host wrote {}.".format(
+                self.written, expected.hex(), data.hex()))
+        self.written += len(data)
+        return len(data)
+
+    def read(self, count):
+        self._start_clock()
+        data = bytearray()
+        while len(data) < count and self.index < len(self.responses):
+            (written, timestamp_ns, response) = self.responses[self.index]
+            if written > self.written:
+                break
+
+            if self.realtime:
+                delay_ns = timestamp_ns + self.clock_offset_ns - time.perf_counter_ns()
+                if delay_ns > 0:
+                    time.sleep(delay_ns / 1000000000)
+
+            chunk = response[self.offset:self.offset + count - len(data)]
+            data += chunk
+            self.offset += len(chunk)
+            if self.offset == len(response):
+                self.index += 1
+                self.offset = 0
+
+        return bytes(data)
+
+    def readinto(self, buf):
+        view = memoryview(buf).cast('B')
+        data = self.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+
+def open_transport(port, timeout=1, write_timeout=1):
+    '''Open a transport by name.
+
+    port: Either a serial port, "usb" to use libusb with the default BROM
+          VID/PID, "usb:VID:PID" (in hex) to use libusb with a specific
+          device, or "replay:PATH" or "replay-realtime:PATH" to play back a
+          capture file made with CaptureTransport.
+    '''
+    if port.startswith("replay:"):
+        return ReplayTransport(port[len("replay:"):])
+    if port.startswith("replay-realtime:"):
+        return ReplayTransport(port[len("replay-realtime:"):], realtime=True)
+
+    if port == "usb" or port.startswith("usb:"):
+        vid = None
+        pid = None
+        if port != "usb":
+            (vid, pid) = (int(i, 16) for i in port.split(":")[1:3])
+        return UsbTransport(vid, pid, timeout=timeout, write_timeout=write_timeout)
+
+    return SerialTransport(port, timeout=timeout, write_timeout=write_timeout)
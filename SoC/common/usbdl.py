@@ -20,12 +20,24 @@
 
 
 import argparse
+import array
+import atexit
 import binascii
-import serial
+import json
+import os
 import struct
 import sys
 import time
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from dumpfile import DumpFile
+from transport import CaptureTransport, open_transport
+from usbdl_trace import Tracer
+
 
 def auto_int(i):
     return int(i, 0)
@@ -37,6 +49,115 @@ def print_ranges(ranges):
     for base, count in sorted(ranges.items()):
         print("0x{:08X}: 0x{:08x}".format(base, count))
 
+def print_holes(holes):
+    for base, count in holes:
+        print("Warning: Couldn't read 0x{:08X}-0x{:08X}.".format(base, base + count - 1))
+
+def print_progress(sent, total, bytes_per_second):
+    end = '\n' if sent == total else ''
+    print("\r{}/{} bytes ({:.0f}%, {:.2f} MB/s)".format(sent, total, sent*100/max(total, 1), bytes_per_second/1000000), end=end, flush=True)
+
+def payload_length(data):
+    '''Return the number of bytes in a payload.
+
+    data: A bytes-like object (including an mmap), or a binary file object,
+          in which case the length is the number of bytes between the current
+          position and the end of the file.
+    '''
+    try:
+        return memoryview(data).nbytes
+    except TypeError:
+        pass
+
+    pos = data.tell()
+    end = data.seek(0, os.SEEK_END)
+    data.seek(pos)
+
+    return end - pos
+
+def payload_chunks(data, chunk_size):
+    '''Yield a payload in chunks of at most chunk_size bytes.
+
+    data: A bytes-like object (including an mmap), or a binary file object.
+          File objects are read into a single reused buffer, so the whole
+          file never needs to be in memory at once.
+    '''
+    try:
+        view = memoryview(data).cast('B')
+    except TypeError:
+        buf = memoryview(bytearray(chunk_size))
+        while True:
+            count = data.readinto(buf)
+            if not count:
+                break
+            yield buf[:count]
+        return
+
+    for offset in range(0, len(view), chunk_size):
+        yield view[offset:offset+chunk_size]
+
+
+def xor16(data):
+    '''Calculate the XOR of all the little-endian 16-bit words in a buffer.
+
+    data: A bytes-like object with an even length.
+    '''
+    data = memoryview(data).cast('B')
+    assert len(data) % 2 == 0
+
+    if numpy is not None:
+        return int(numpy.bitwise_xor.reduce(numpy.frombuffer(data, dtype='<u2'), initial=0))
+
+    # Fold the buffer in half until only one word is left. Each fold is a
+    # single XOR of two big ints, so this runs in linear time without
+    # touching each word from Python.
+    while len(data) > 2:
+        half = (len(data) // 4) * 2
+        folded = int.from_bytes(data[:half], 'little') ^ int.from_bytes(data[half:2*half], 'little')
+        if len(data) % 4:
+            folded ^= int.from_bytes(data[2*half:], 'little')
+        data = memoryview(folded.to_bytes(half, 'little'))
+
+    return int.from_bytes(data, 'little')
+
+
+class XorChecksum:
+    '''The 16-bit XOR checksum the BROM calculates over DA, certificate, and
+    auth payloads.
+
+    Data can be added a chunk at a time with update(), and the chunks don't
+    need to have even lengths.
+    '''
+
+    def __init__(self, data=b''):
+        self.checksum = 0
+        self.leftover = None
+        self.update(data)
+
+    def update(self, data):
+        data = memoryview(data).cast('B')
+        if not data:
+            return
+
+        if self.leftover is not None:
+            self.checksum ^= self.leftover | (data[0] << 8)
+            self.leftover = None
+            data = data[1:]
+
+        if len(data) % 2:
+            self.leftover = data[-1]
+            data = data[:-1]
+
+        self.checksum ^= xor16(data)
+
+    def value(self):
+        '''Return the checksum, padding an odd-length payload with a zero
+        byte.
+        '''
+        if self.leftover is not None:
+            return self.checksum ^ self.leftover
+        return self.checksum
+
 
 class ChecksumError(Exception):
     pass
@@ -59,6 +180,163 @@ class SocNotRecognizedError(Exception):
 class NotHandshakedError(Exception):
     pass
 
+class CqdmaTimeoutError(Exception):
+    pass
+
+class RegisterBatch:
+    '''Queues 32-bit register reads and writes and sends them with as few
+    commands and round trips as possible.
+
+    Consecutive operations of the same kind on contiguous, ascending
+    addresses are merged into a single multi-word CMD_READ32 or CMD_WRITE32,
+    which the BROM carries out a word at a time in the same order. Nothing is
+    ever reordered, so the device sees the same sequence of accesses it would
+    from separate commands.
+
+    Create one with UsbDl.batch(). When it's used as a context manager, it's
+    flushed when the block exits without an exception.
+
+    pipeline: Send the commands without waiting for the response to each one
+              before sending the next, so a whole batch costs about one round
+              trip. Only use this when none of the commands should fail: if
+              the BROM rejects one, it will try to run the rest of the data
+              that was sent as commands.
+    '''
+
+    # The most response bytes to have outstanding at once when pipelining,
+    # so neither side's buffers fill up while the other is blocked.
+    pipeline_window = 0x1000
+
+    def __init__(self, usbdl, pipeline=False):
+        self.usbdl = usbdl
+        self.pipeline = pipeline
+        # Each entry is [command, addr, words to write or number of words to
+        # read, [(read index, word offset, word count), ...]].
+        self.ops = []
+        self.read_count = 0
+        self.results = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def write32(self, addr, words):
+        '''Queue a write of 32-bit words starting at an address.
+
+        addr: A 32-bit address as an int.
+        words: A list of 32-bit ints to write starting at address addr.
+        '''
+        last = self.ops[-1] if self.ops else None
+        if last and last[0] == 'CMD_WRITE32' and last[1] + 4 * len(last[2]) == addr:
+            last[2].extend(words)
+        else:
+            self.ops.append(['CMD_WRITE32', addr, list(words), []])
+
+    def read32(self, addr, word_count=1):
+        '''Queue a read of 32-bit words starting at an address.
+
+        addr: The 32-bit starting address as an int.
+        word_count: The number of words to read as an int.
+
+        Returns the index of this read's words in the list returned by
+        flush().
+        '''
+        index = self.read_count
+        self.read_count += 1
+
+        last = self.ops[-1] if self.ops else None
+        if last and last[0] == 'CMD_READ32' and last[1] + 4 * last[2] == addr:
+            last[3].append((index, last[2], word_count))
+            last[2] += word_count
+        else:
+            self.ops.append(['CMD_READ32', addr, word_count, [(index, 0, word_count)]])
+
+        return index
+
+    def flush(self):
+        '''Send everything that has been queued.
+
+        Returns a list with the words from each read, in the order the reads
+        were queued. The list is also kept in the results attribute.
+        '''
+        results = [None] * self.read_count
+        ops = self.ops
+        self.ops = []
+        self.read_count = 0
+
+        if self.pipeline:
+            window = []
+            window_size = 0
+            for op in ops:
+                size = self._response_size(op)
+                if window and window_size + size > self.pipeline_window:
+                    self._send_pipelined(window, results)
+                    window = []
+                    window_size = 0
+                window.append(op)
+                window_size += size
+            if window:
+                self._send_pipelined(window, results)
+        else:
+            for (command, addr, payload, reads) in ops:
+                if command == 'CMD_WRITE32':
+                    self.usbdl.cmd_write32(addr, payload)
+                else:
+                    self._store(reads, self.usbdl.cmd_read32(addr, payload), results)
+
+        self.results = results
+        return results
+
+    def _store(self, reads, words, results):
+        for (index, offset, count) in reads:
+            results[index] = words[offset:offset+count]
+
+    def _response_size(self, op):
+        (command, addr, payload, reads) = op
+        if command == 'CMD_WRITE32':
+            # Echoed header, status, echoed words, and status.
+            return 9 + 2 + 4 * len(payload) + 2
+        # Echoed header, status, words, and status.
+        return 9 + 2 + 4 * payload + 2
+
+    def _send_pipelined(self, ops, results):
+        usbdl = self.usbdl
+
+        headers = []
+        request = bytearray()
+        for (command, addr, payload, reads) in ops:
+            count = len(payload) if command == 'CMD_WRITE32' else payload
+            header = struct.pack('>BII', usbdl.commands[command], addr, count)
+            headers.append(header)
+            request += header
+            if command == 'CMD_WRITE32':
+                request += struct.pack('>{}I'.format(count), *payload)
+        usbdl._send_bytes(request, echo=False)
+
+        for (header, (command, addr, payload, reads)) in zip(headers, ops):
+            usbdl._check_echo(header, usbdl._recv_bytes(len(header)))
+
+            status = usbdl.get_word()
+            if command == 'CMD_WRITE32':
+                if status > 0xff:
+                    raise ProtocolError(status)
+                data = struct.pack('>{}I'.format(len(payload)), *payload)
+                usbdl._check_echo(data, usbdl._recv_bytes(len(data)))
+                status = usbdl.get_word()
+                if status > 0xff:
+                    raise ProtocolError(status)
+            else:
+                if status != 0:
+                    raise ProtocolError(status)
+                words = usbdl._recv_words(payload).tolist()
+                status = usbdl.get_word()
+                if status != 0:
+                    raise ProtocolError(status)
+                self._store(reads, words, results)
+
 class UsbDl:
     commands = {
         'CMD_C8': 0xC8, # Don't know the meaning of this yet.
@@ -212,11 +490,43 @@ class UsbDl:
         },
     }
 
-    def __init__(self, port, timeout=1, write_timeout=1, debug=False):
+    # The maximum number of times to poll the CQDMA enable bit before giving
+    # up on a transfer.
+    cqdma_max_polls = 1000
+
+    # The number of bytes to send at a time when sending DA, certificate, and
+    # auth payloads.
+    payload_chunk_size = 0x1000
+
+    def __init__(self, port, timeout=1, write_timeout=1, debug=False, transport=None, batch_echo=False, tracer=None, capture=None):
+        '''Connect to a SoC in USB DL mode.
+
+        port: The serial port to connect to, or "usb"/"usb:VID:PID" to talk
+              to the device with libusb. See transport.open_transport().
+        transport: An already-open transport to use instead of port.
+        batch_echo: Send each command's opcode and arguments in one write and
+                    check all their echoes with one read, instead of waiting
+                    for the echo of each field before sending the next one.
+        tracer: An optional usbdl_trace.Tracer to record every command with.
+        capture: An optional file to record every byte sent and received to,
+                 for playing back later with "replay:PATH" as the port.
+        '''
         self.debug = debug
-        self.ser = serial.Serial(port, timeout=timeout, write_timeout=write_timeout)
+        self.batch_echo = batch_echo
+        self.cqdma_polls = 0
+        # Whether unlock_memory_access() has disabled the bounds check.
+        self.bounds_check_disabled = False
+        if transport is None:
+            transport = open_transport(port, timeout=timeout, write_timeout=write_timeout)
+        if capture is not None:
+            transport = CaptureTransport(transport, capture)
+        self.ser = transport
+        self.tracer = None
+        if tracer is not None:
+            self.set_tracer(tracer)
 
         hw_code = self.cmd_get_hw_code()
+        self.hw_code = hw_code
         self.soc = self.socs.get(hw_code)
         if self.soc is None:
             raise SocNotRecognizedError("SoC with HW code 0x{:04x} not recognized.".format(hw_code))
@@ -234,12 +544,13 @@ class UsbDl:
 
             timeout = 60 # 0x3fff is no timeout. Less than that is timeout in seconds.
             usbdl_flag = (0x444C << 16) | (timeout << 2) | 0x00000001 # USBDL_BIT_EN
-            self.cmd_write32(usbdl_base + 0x00, [usbdl_flag])  # USBDL_FLAG/BOOT_MISC0
+            with self.batch() as batch:
+                batch.write32(usbdl_base + 0x00, [usbdl_flag])  # USBDL_FLAG/BOOT_MISC0
 
-            # Make sure USBDL_FLAG is not reset by the WDT.
-            self.cmd_write32(usbdl_base + 0x20, [0xAD98])  # MISC_LOCK_KEY
-            self.cmd_write32(usbdl_base + 0x28, [0x00000001])  # RST_CON
-            self.cmd_write32(usbdl_base + 0x20, [0])  # MISC_LOCK_KEY
+                # Make sure USBDL_FLAG is not reset by the WDT.
+                batch.write32(usbdl_base + 0x20, [0xAD98])  # MISC_LOCK_KEY
+                batch.write32(usbdl_base + 0x28, [0x00000001])  # RST_CON
+                batch.write32(usbdl_base + 0x20, [0])  # MISC_LOCK_KEY
 
             # WDT reset.
             self.wdt_reset()
@@ -247,6 +558,25 @@ class UsbDl:
             # Raise exception because we won't be able to talk to the device any more.
             raise DeviceResetException("The device has been reset to enter BROM DL mode.")
 
+    def close(self):
+        self.ser.close()
+
+    def set_tracer(self, tracer):
+        '''Start recording every command with a tracer, or stop if tracer is
+        None. See usbdl_trace.Tracer.
+        '''
+        if self.tracer is not None:
+            self.tracer.detach(self)
+        self.tracer = tracer
+        if tracer is not None:
+            tracer.attach(self)
+
+    def _check_echo(self, data, echo_data):
+        if echo_data and echo_data[0] == data[0]+0x1:
+            raise NotHandshakedError
+        if echo_data != data:
+            raise EchoBytesMismatchException
+
     def _send_bytes(self, data, echo=True):
         data = bytes(data)
         if self.debug:
@@ -256,10 +586,45 @@ class UsbDl:
             echo_data = self.ser.read(len(data))
             if self.debug:
                 print("<- {}".format(binascii.b2a_hex(echo_data)))
-            if echo_data and echo_data[0] == data[0]+0x1:
-                raise NotHandshakedError
-            if echo_data != data:
-                raise EchoBytesMismatchException
+            self._check_echo(data, echo_data)
+
+    def _send_fields(self, fields):
+        '''Send a sequence of fields that the device echoes back.
+
+        In batch_echo mode, all the fields are sent with a single write and
+        their echoes are received with a single read. The echo of each field
+        is still checked separately, so the same exceptions are raised as
+        when the fields are sent one at a time.
+
+        fields: A list of bytes objects.
+        '''
+        if not self.batch_echo:
+            for field in fields:
+                self._send_bytes(field)
+            return
+
+        data = b''.join(fields)
+        if self.debug:
+            print("-> {}".format(binascii.b2a_hex(data)))
+        self.ser.write(data)
+        echo_data = self.ser.read(len(data))
+        if self.debug:
+            print("<- {}".format(binascii.b2a_hex(echo_data)))
+
+        pos = 0
+        for field in fields:
+            self._check_echo(field, echo_data[pos:pos+len(field)])
+            pos += len(field)
+
+    def _send_command(self, command, *args):
+        '''Send a command opcode followed by its 32-bit arguments.
+
+        command: The name of the command in UsbDl.commands.
+        args: The 32-bit arguments as ints.
+        '''
+        fields = [bytes([self.commands[command]])]
+        fields.extend(struct.pack('>I', arg) for arg in args)
+        self._send_fields(fields)
 
     def _recv_bytes(self, count):
         data = self.ser.read(count)
@@ -269,6 +634,49 @@ class UsbDl:
             raise NotEnoughDataException
         return bytes(data)
 
+    def _recv_into(self, buf):
+        '''Fill a writable buffer with bytes from the serial port.
+
+        buf: A bytearray, array, or other object supporting the writable
+             buffer protocol.
+        '''
+        view = memoryview(buf).cast('B')
+        count = len(view)
+        pos = 0
+        while pos < count:
+            received = self.ser.readinto(view[pos:])
+            if not received:
+                break
+            pos += received
+        if self.debug:
+            print("<- {}".format(binascii.b2a_hex(view[:pos])))
+        if pos != count:
+            raise NotEnoughDataException
+
+    def _recv_words(self, word_count):
+        '''Receive big-endian 32-bit words into an array of native ints.'''
+        words = array.array('I', bytes(4 * word_count))
+        assert words.itemsize == 4
+
+        self._recv_into(words)
+        if sys.byteorder == 'little':
+            words.byteswap()
+
+        return words
+
+    def _recv_words_into(self, buf):
+        '''Receive big-endian 32-bit words straight into a writable buffer,
+        and swap them in place to little-endian, the order their bytes are in
+        memory.
+        '''
+        self._recv_into(buf)
+        with memoryview(buf) as view, view.cast('B') as data:
+            (b0, b1, b2, b3) = (data[0::4].tobytes(), data[1::4].tobytes(), data[2::4].tobytes(), data[3::4].tobytes())
+            data[0::4] = b3
+            data[1::4] = b2
+            data[2::4] = b1
+            data[3::4] = b0
+
     def get_word(self):
         '''Read a big-endian 16-bit integer from the serial port.'''
         return struct.unpack('>H', self._recv_bytes(2))[0]
@@ -285,6 +693,67 @@ class UsbDl:
         '''Write a big-endian 32-bit integer to the serial port.'''
         self._send_bytes(struct.pack('>I', dword))
 
+    def _send_payload(self, data, description, print_speed=False, chunk_size=None, progress=None):
+        '''Send a checksummed payload and check the BROM's response.
+
+        The checksum is calculated a chunk at a time as the payload is sent.
+
+        data: The payload, as a bytes-like object, mmap, or binary file object.
+        description: What the payload is, for the speed message.
+        chunk_size: The number of bytes to send at a time. Defaults to
+                    payload_chunk_size.
+        progress: An optional function that is called after each chunk is sent
+                  with the number of bytes sent so far, the total number of
+                  bytes, and the average throughput in bytes per second.
+        '''
+        if chunk_size is None:
+            chunk_size = self.payload_chunk_size
+        assert chunk_size > 0
+
+        length = payload_length(data)
+        checksum = XorChecksum()
+
+        sent = 0
+        start_ns = time.perf_counter_ns()
+        for chunk in payload_chunks(data, chunk_size):
+            chunk = chunk[:length-sent]
+            checksum.update(chunk)
+            self._send_bytes(chunk, echo=False)
+            sent += len(chunk)
+            if progress:
+                elapsed = max(time.perf_counter_ns() - start_ns, 1)
+                progress(sent, length, sent*1000000000//elapsed)
+            if sent == length:
+                break
+        end_ns = time.perf_counter_ns()
+
+        if sent != length:
+            raise NotEnoughDataException("Only {} of {} {} bytes could be read from the source.".format(sent, length, description))
+
+        if print_speed:
+            elapsed = end_ns - start_ns
+            print("Sent {} {} bytes in {:.6f} seconds ({} bytes per second).".format(length, description, elapsed/1000000000, length*1000000000//elapsed))
+
+        remote_checksum = self.get_word()
+
+        calc_checksum = checksum.value()
+        if remote_checksum != calc_checksum:
+            raise ChecksumError("Checksum mismatch: Expected 0x{:04x}, got 0x{:04x}.".format(calc_checksum, remote_checksum))
+
+        status = self.get_word()
+        if status > 0xff:
+            raise ProtocolError(status)
+
+    def batch(self, pipeline=None):
+        '''Return a RegisterBatch for queueing register reads and writes.
+
+        pipeline: Whether to pipeline the batch's commands. Defaults to the
+                  batch_echo setting.
+        '''
+        if pipeline is None:
+            pipeline = self.batch_echo
+        return RegisterBatch(self, pipeline=pipeline)
+
     def cmd_C8(self, subcommand):
         subcommands = {
             'B0': 0xB0,
@@ -328,18 +797,25 @@ class UsbDl:
         addr: The 32-bit starting address as an int.
         word_count: The number of words to read as an int.
         '''
-        words = []
+        return self.cmd_read32_array(addr, word_count).tolist()
 
-        self._send_bytes([self.commands['CMD_READ32']])
-        self.put_dword(addr)
-        self.put_dword(word_count)
+    def cmd_read32_array(self, addr, word_count):
+        '''Read 32-bit words starting at an address into an array.
+
+        The whole payload is received into a single preallocated buffer and
+        converted from big-endian in one pass, so this is much faster than
+        reading the words one at a time.
+
+        addr: The 32-bit starting address as an int.
+        word_count: The number of words to read as an int.
+        '''
+        self._send_command('CMD_READ32', addr, word_count)
 
         status = self.get_word()
         if status != 0:
             raise ProtocolError(status)
 
-        for i in range(word_count):
-            words.append(self.get_dword())
+        words = self._recv_words(word_count)
 
         status = self.get_word()
         if status != 0:
@@ -347,30 +823,47 @@ class UsbDl:
 
         return words
 
+    def cmd_read32_into(self, addr, buf):
+        '''Read 32-bit words starting at an address straight into a writable
+        buffer, in the order their bytes are in memory.
+
+        addr: The 32-bit starting address as an int.
+        buf: A writable buffer whose length is a multiple of four, like a
+             DumpFile view.
+        '''
+        word_count = memoryview(buf).nbytes // 4
+        self._send_command('CMD_READ32', addr, word_count)
+
+        status = self.get_word()
+        if status != 0:
+            raise ProtocolError(status)
+
+        self._recv_words_into(buf)
+
+        status = self.get_word()
+        if status != 0:
+            raise ProtocolError(status)
+
     def cmd_write32(self, addr, words):
         '''Write 32 bit words starting at an address.
 
         addr: A 32-bit address as an int.
         words: A list of 32-bit ints to write starting at address addr.
         '''
-        self._send_bytes([self.commands['CMD_WRITE32']])
-        self.put_dword(addr)
-        self.put_dword(len(words))
+        self._send_command('CMD_WRITE32', addr, len(words))
 
         status = self.get_word()
         if status > 0xff:
             raise ProtocolError(status)
 
-        for word in words:
-            self.put_dword(word)
+        self._send_fields([struct.pack('>I', word) for word in words])
 
         status = self.get_word()
         if status > 0xff:
             raise ProtocolError(status)
 
     def cmd_jump_da(self, addr):
-        self._send_bytes([self.commands['CMD_JUMP_DA']])
-        self.put_dword(addr)
+        self._send_command('CMD_JUMP_DA', addr)
 
         status = self.get_word()
         if status > 0xff:
@@ -383,40 +876,25 @@ class UsbDl:
         if status > 0xff:
             raise ProtocolError(status)
 
-    def cmd_send_da(self, load_addr, data, sig_length=0, print_speed=False):
-        self._send_bytes([self.commands['CMD_SEND_DA']])
-        self.put_dword(load_addr)
-        self.put_dword(len(data))
-        self.put_dword(sig_length)
-
-        status = self.get_word()
-        if status > 0xff:
-            raise ProtocolError(status)
-
-        calc_checksum = 0
-        padded_data = data
-        if len(padded_data) % 2 != 0:
-            padded_data += b'\0'
-        for i in range(0, len(padded_data), 2):
-            calc_checksum ^= struct.unpack_from('<H', padded_data, i)[0]
-
-        start_ns = time.perf_counter_ns()
-        self._send_bytes(data, echo=False)
-        end_ns = time.perf_counter_ns()
-
-        if print_speed:
-            elapsed = end_ns - start_ns
-            print("Sent {} DA bytes in {:.6f} seconds ({} bytes per second).".format(len(data), elapsed/1000000000, len(data)*1000000000//elapsed))
-
-        remote_checksum = self.get_word()
+    def cmd_send_da(self, load_addr, data, sig_length=0, print_speed=False, chunk_size=None, progress=None):
+        '''Send a DA to be loaded at an address.
 
-        if remote_checksum != calc_checksum:
-            raise ChecksumError("Checksum mismatch: Expected 0x{:04x}, got 0x{:04x}.".format(calc_checksum, remote_checksum))
+        load_addr: The 32-bit load address as an int.
+        data: The DA, as a bytes-like object, mmap, or binary file object. File
+              objects are sent from their current position to the end.
+        sig_length: The length of the signature at the end of the DA.
+        chunk_size: The number of bytes to send at a time.
+        progress: An optional function that is called after each chunk with
+                  the bytes sent, the total bytes, and the bytes per second.
+        '''
+        self._send_command('CMD_SEND_DA', load_addr, payload_length(data), sig_length)
 
         status = self.get_word()
         if status > 0xff:
             raise ProtocolError(status)
 
+        self._send_payload(data, "DA", print_speed=print_speed, chunk_size=chunk_size, progress=progress)
+
     def cmd_get_target_config(self):
         self._send_bytes([self.commands['CMD_GET_TARGET_CONFIG']])
 
@@ -445,8 +923,7 @@ class UsbDl:
             raise ProtocolError(status)
 
     def cmd_uart1_set_baud(self, baud):
-        self._send_bytes([self.commands['CMD_UART1_SET_BAUD']])
-        self.put_dword(baud)
+        self._send_command('CMD_UART1_SET_BAUD', baud)
 
         status = self.get_word()
         if status != 0:
@@ -460,8 +937,7 @@ class UsbDl:
         return log_bytes
 
     def cmd_jump_da_64(self, addr):
-        self._send_bytes([self.commands['CMD_JUMP_DA_64']])
-        self.put_dword(addr)
+        self._send_command('CMD_JUMP_DA_64', addr)
 
         self._send_bytes([0x01])  # Must be 1. If it's 0, boot_aarch64_magic
                                   # must not be sent, and the BROM will jump to
@@ -489,36 +965,13 @@ class UsbDl:
         return log_bytes
 
     def scmd_send_cert(self, cert, print_speed=False):
-        self._send_bytes([self.commands['SCMD_SEND_CERT']])
-        self.put_dword(len(cert))
+        self._send_command('SCMD_SEND_CERT', payload_length(cert))
 
         status = self.get_word()
         if status > 0xff:
             raise ProtocolError(status)
 
-        calc_checksum = 0
-        padded_cert = cert
-        if len(padded_cert) % 2 != 0:
-            padded_cert += b'\0'
-        for i in range(0, len(padded_cert), 2):
-            calc_checksum ^= struct.unpack_from('<H', padded_cert, i)[0]
-
-        start_ns = time.perf_counter_ns()
-        self._send_bytes(cert, echo=False)
-        end_ns = time.perf_counter_ns()
-
-        if print_speed:
-            elapsed = end_ns - start_ns
-            print("Sent {} certificate bytes in {:.6f} seconds ({} bytes per second).".format(len(cert), elapsed/1000000000, len(cert)*1000000000//elapsed))
-
-        remote_checksum = self.get_word()
-
-        if remote_checksum != calc_checksum:
-            raise ChecksumError("Checksum mismatch: Expected 0x{:04x}, got 0x{:04x}.".format(calc_checksum, remote_checksum))
-
-        status = self.get_word()
-        if status > 0xff:
-            raise ProtocolError(status)
+        self._send_payload(cert, "certificate", print_speed=print_speed)
 
     def scmd_get_me_id(self):
         self._send_bytes([self.commands['SCMD_GET_ME_ID']])
@@ -532,36 +985,13 @@ class UsbDl:
         return me_id
 
     def scmd_send_auth(self, auth, print_speed=False):
-        self._send_bytes([self.commands['SCMD_SEND_AUTH']])
-        self.put_dword(len(auth))
+        self._send_command('SCMD_SEND_AUTH', payload_length(auth))
 
         status = self.get_word()
         if status > 0xff:
             raise ProtocolError(status)
 
-        calc_checksum = 0
-        padded_auth = auth
-        if len(padded_auth) % 2 != 0:
-            padded_auth += b'\0'
-        for i in range(0, len(padded_auth), 2):
-            calc_checksum ^= struct.unpack_from('<H', padded_auth, i)[0]
-
-        start_ns = time.perf_counter_ns()
-        self._send_bytes(auth, echo=False)
-        end_ns = time.perf_counter_ns()
-
-        if print_speed:
-            elapsed = end_ns - start_ns
-            print("Sent {} TOOL_AUTH bytes in {:.6f} seconds ({} bytes per second).".format(len(auth), elapsed/1000000000, len(auth)*1000000000//elapsed))
-
-        remote_checksum = self.get_word()
-
-        if remote_checksum != calc_checksum:
-            raise ChecksumError("Checksum mismatch: Expected 0x{:04x}, got 0x{:04x}.".format(calc_checksum, remote_checksum))
-
-        status = self.get_word()
-        if status > 0xff:
-            raise ProtocolError(status)
+        self._send_payload(auth, "TOOL_AUTH", print_speed=print_speed)
 
     def scmd_get_soc_id(self):
         self._send_bytes([self.commands['SCMD_GET_SOC_ID']])
@@ -604,12 +1034,25 @@ class UsbDl:
 
         return True
 
-    def memory_range_test(self, addr, byte_count, byte_granularity=4, print_speed=False):
+    # Where memory_range_test() caches the results of adaptive scans.
+    range_test_cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "usbdl")
+
+    def memory_range_test(self, addr, byte_count, byte_granularity=4, print_speed=False, adaptive=False, coarse_granularity=0x10000, cache=True):
         '''Test a range of memory to see where we have contiguous read access.
 
         addr: A 32-bit address as an int.
         count: The length of data to read, in bytes.
+        adaptive: Instead of reading every byte_granularity bytes, probe every
+                  coarse_granularity bytes and bisect between neighboring
+                  probes that disagree to find the edge at byte_granularity
+                  resolution. Holes smaller than coarse_granularity that
+                  don't sit on a probe will be missed.
+        cache: In adaptive mode, save the results to disk per SoC and reuse
+               them for identical scans.
         '''
+        if adaptive:
+            return self._memory_range_test_adaptive(addr, byte_count, byte_granularity, coarse_granularity, cache, print_speed)
+
         word_count = byte_count//4
         if (byte_count % 4) > 0:
             word_count += 1
@@ -649,62 +1092,202 @@ class UsbDl:
 
         return ranges
 
-    def cqdma_read32(self, addr, word_count):
+    def _memory_range_test_adaptive(self, addr, byte_count, byte_granularity, coarse_granularity, cache, print_speed):
+        word_count = byte_count//4
+        if (byte_count % 4) > 0:
+            word_count += 1
+
+        assert byte_granularity > 0
+        assert byte_granularity % 4 == 0
+        assert coarse_granularity >= byte_granularity
+        assert coarse_granularity % byte_granularity == 0
+
+        if byte_count <= 0:
+            return {}
+
+        cache_path = os.path.join(self.range_test_cache_dir, "ranges-{:04x}.json".format(self.hw_code))
+        # What's readable depends on whether the bounds check is on, so keep
+        # separate results for each.
+        cache_key = "0x{:08x}+0x{:x}/0x{:x}/0x{:x}/{}".format(addr, byte_count, byte_granularity, coarse_granularity,
+                "unlocked" if self.bounds_check_disabled else "locked")
+        cached = {}
+        if cache and os.path.exists(cache_path):
+            with open(cache_path, 'r') as cache_file:
+                cached = json.load(cache_file)
+            if cache_key in cached:
+                print("Using cached ranges from {}.".format(cache_path))
+                return {int(base, 0): count for base, count in cached[cache_key].items()}
+
+        # Memory is probed in units of byte_granularity, so work with unit
+        # indices instead of addresses.
+        bytes_to_read = word_count * 4
+        unit_count = (bytes_to_read + byte_granularity - 1) // byte_granularity
+        step = coarse_granularity // byte_granularity
+        readable = {}
+
+        def probe(unit):
+            if unit not in readable:
+                try:
+                    self.cmd_read32(addr + unit * byte_granularity, byte_granularity // 4)
+                    readable[unit] = True
+                except ProtocolError:
+                    readable[unit] = False
+            return readable[unit]
+
+        start_ns = time.perf_counter_ns()
+
+        # Coarse pass.
+        samples = list(range(0, unit_count, step))
+        if samples[-1] != unit_count - 1:
+            samples.append(unit_count - 1)
+        for unit in samples:
+            probe(unit)
+
+        # Find each edge between a pair of samples that disagree, and assume
+        # everything else between samples matches the nearest sample.
+        spans = []
+        for (lo, hi) in zip(samples, samples[1:]):
+            if readable[lo] == readable[hi]:
+                spans.append((lo, hi, readable[lo]))
+                continue
+            left = lo
+            right = hi
+            while right - left > 1:
+                mid = (left + right) // 2
+                if probe(mid) == readable[lo]:
+                    left = mid
+                else:
+                    right = mid
+            spans.append((lo, left, readable[lo]))
+            spans.append((right, hi, readable[hi]))
+        if len(samples) == 1:
+            spans.append((0, 0, readable[0]))
+
+        end_ns = time.perf_counter_ns()
+
+        # Merge the readable spans into the same format as the linear scan.
+        ranges = {}
+        run_start = None
+        run_end = None
+        for (first, last, is_readable) in spans:
+            if not is_readable:
+                continue
+            if run_start is not None and first <= run_end + 1:
+                run_end = max(run_end, last)
+                continue
+            if run_start is not None:
+                ranges[addr + run_start * byte_granularity] = (run_end - run_start + 1) * byte_granularity
+            run_start = first
+            run_end = last
+        if run_start is not None:
+            ranges[addr + run_start * byte_granularity] = (run_end - run_start + 1) * byte_granularity
+
+        print("Used {} probes instead of {}.".format(len(readable), unit_count))
+
+        if print_speed:
+            elapsed = end_ns - start_ns
+            print("Scanned {} bytes in {:.6f} seconds ({} bytes per second).".format(bytes_to_read, elapsed/1000000000, bytes_to_read*1000000000//elapsed))
+
+        if cache:
+            cached[cache_key] = {"0x{:08x}".format(base): count for base, count in ranges.items()}
+            os.makedirs(self.range_test_cache_dir, exist_ok=True)
+            with open(cache_path, 'w') as cache_file:
+                json.dump(cached, cache_file, indent=4, sort_keys=True)
+
+        return ranges
+
+    def _cqdma_transfer(self, src, dst, length):
+        '''Run a single CQDMA transfer and wait for it to finish.
+
+        src: The 32-bit source address as an int.
+        dst: The 32-bit destination address as an int.
+        length: The number of bytes to transfer as an int.
+
+        Returns the number of times the enable bit was polled.
+        '''
+        cqdma_base = self.soc['cqdma_base']
+
+        # Set DMA source address, destination address, and transfer length in
+        # bytes. These registers are contiguous, so set them all at once.
+        self.cmd_write32(cqdma_base+0x1C, [src, dst, length])
+        # Start DMA transfer.
+        self.cmd_write32(cqdma_base+0x08, [0x00000001])
+        # Wait for transaction to finish.
+        polls = 0
+        for polls in range(1, self.cqdma_max_polls + 1):
+            if (self.cmd_read32(cqdma_base+0x08, 1)[0] & 1) == 0:
+                break
+        else:
+            raise CqdmaTimeoutError("CQDMA transfer from 0x{:08x} to 0x{:08x} did not finish after {} polls.".format(src, dst, polls))
+
+        self.cqdma_polls += polls
+
+        return polls
+
+    def cqdma_read32(self, addr, word_count, chunk_size=None):
         '''Read 32-bit words starting at an address, using the CQDMA peripheral.
 
         addr: The 32-bit starting address as an int.
         word_count: The number of words to read as an int.
+        chunk_size: The number of bytes to move per DMA transfer. Defaults to
+                    the SoC's "cqdma_chunk_size", or 4 if that isn't set.
+                    It must not overrun the window at the SoC's "tmp_addr".
         '''
 
         tmp_addr = self.soc['tmp_addr']
-        cqdma_base = self.soc['cqdma_base']
+        if chunk_size is None:
+            chunk_size = self.soc.get('cqdma_chunk_size', 4)
+        assert chunk_size > 0
+        assert chunk_size % 4 == 0
 
         words = []
-        for i in range(word_count):
-            # Set DMA source address.
-            self.cmd_write32(cqdma_base+0x1C, [addr+i*4])
-            # Set DMA destination address.
-            self.cmd_write32(cqdma_base+0x20, [tmp_addr])
-            # Set DMA transfer length in bytes.
-            self.cmd_write32(cqdma_base+0x24, [4])
-            # Start DMA transfer.
-            self.cmd_write32(cqdma_base+0x08, [0x00000001])
-            # Wait for transaction to finish.
-            while True:
-                if (self.cmd_read32(cqdma_base+0x08, 1)[0] & 1) == 0:
-                    break
-            # Read word from tmp_addr.
-            words.extend(self.cmd_read32(tmp_addr, 1))
+        for offset in range(0, word_count * 4, chunk_size):
+            length = min(chunk_size, word_count * 4 - offset)
+            self._cqdma_transfer(addr+offset, tmp_addr, length)
+            # Read words from tmp_addr.
+            words.extend(self.cmd_read32(tmp_addr, length // 4))
 
         return words
 
-    def cqdma_write32(self, addr, words):
+    def cqdma_write32(self, addr, words, chunk_size=None):
         '''Write 32 bit words starting at an address, using the CQDMA peripheral.
 
         addr: A 32-bit address as an int.
         words: A list of 32-bit ints to write starting at address addr.
+        chunk_size: The number of bytes to move per DMA transfer. Defaults to
+                    the SoC's "cqdma_chunk_size", or 4 if that isn't set.
+                    It must not overrun the window at the SoC's "tmp_addr".
         '''
 
         tmp_addr = self.soc['tmp_addr']
-        cqdma_base = self.soc['cqdma_base']
+        if chunk_size is None:
+            chunk_size = self.soc.get('cqdma_chunk_size', 4)
+        assert chunk_size > 0
+        assert chunk_size % 4 == 0
+
+        chunk_words = chunk_size // 4
+        for i in range(0, len(words), chunk_words):
+            chunk = words[i:i+chunk_words]
+            # Write words to tmp_addr.
+            self.cmd_write32(tmp_addr, chunk)
+            self._cqdma_transfer(tmp_addr, addr+i*4, len(chunk) * 4)
+            # Write dummy words to tmp_addr for error detection.
+            self.cmd_write32(tmp_addr, [0xc0ffeeee] * len(chunk))
+
+    def _memory_read_view(self, addr, count, cqdma=False):
+        '''Read a range of memory to a memoryview of its bytes.'''
+        word_count = count//4
+        if (count % 4) > 0:
+            word_count += 1
 
-        for i in range(len(words)):
-            # Write word to tmp_addr.
-            self.cmd_write32(tmp_addr, [words[i]])
-            # Set DMA source address.
-            self.cmd_write32(cqdma_base+0x1C, [tmp_addr])
-            # Set DMA destination address.
-            self.cmd_write32(cqdma_base+0x20, [addr+i*4])
-            # Set DMA transfer length in bytes.
-            self.cmd_write32(cqdma_base+0x24, [4])
-            # Start DMA transfer.
-            self.cmd_write32(cqdma_base+0x08, [0x00000001])
-            # Wait for transaction to finish.
-            while True:
-                if (self.cmd_read32(cqdma_base+0x08, 1)[0] & 1) == 0:
-                    break
-            # Write dummy word to tmp_addr for error detection.
-            self.cmd_write32(tmp_addr, [0xc0ffeeee])
+        if cqdma:
+            words = array.array('I', self.cqdma_read32(addr, word_count))
+        else:
+            words = self.cmd_read32_array(addr, word_count)
+        if sys.byteorder == 'big':
+            words.byteswap()
+
+        return memoryview(words).cast('B')[:count]
 
     def memory_read(self, addr, count, cqdma=False, print_speed=False):
         '''Read a range of memory to a byte array.
@@ -712,29 +1295,69 @@ class UsbDl:
         addr: A 32-bit address as an int.
         count: The length of data to read, in bytes.
         '''
-        word_count = count//4
-        if (count % 4) > 0:
-            word_count += 1
-
-        words = []
         start_ns = time.perf_counter_ns()
-        if cqdma:
-            words = self.cqdma_read32(addr, word_count)
-        else:
-            words = self.cmd_read32(addr, word_count)
+        data = self._memory_read_view(addr, count, cqdma=cqdma).tobytes()
         end_ns = time.perf_counter_ns()
 
-        data = b''
-        for word in words:
-            data += struct.pack('<I', word)
-        data = data[:count]
-
         if print_speed:
             elapsed = end_ns - start_ns
             print("Read {} bytes in {:.6f} seconds ({} bytes per second).".format(len(data), elapsed/1000000000, len(data)*1000000000//elapsed))
 
         return data
 
+    def memory_dump(self, addr, count, path, chunk_size=0x10000, cqdma=False, print_speed=False, progress=None):
+        '''Dump a range of memory straight to a file.
+
+        The file is memory-mapped and filled in a chunk at a time as the data
+        arrives, so the range never has to fit in memory. Chunks the BROM
+        refuses to read are left as holes in a sparse file, or zeroed if the
+        refusal came after their data, so they always read back as zeros.
+
+        addr: A 32-bit address as an int.
+        count: The length of data to dump, in bytes.
+        path: The file to write the dump to.
+        chunk_size: The number of bytes to read at a time.
+        progress: An optional function that is called after each chunk with
+                  the number of bytes done so far, the total number of bytes,
+                  and the average throughput in bytes per second.
+
+        Returns a list of (address, length) tuples of the ranges that
+        couldn't be read.
+        '''
+        assert chunk_size > 0
+        assert chunk_size % 4 == 0
+
+        holes = []
+        start_ns = time.perf_counter_ns()
+        with DumpFile(path, count) as dump:
+            for offset in range(0, count, chunk_size):
+                length = min(chunk_size, count - offset)
+                try:
+                    if cqdma or length % 4:
+                        dump.write(offset, self._memory_read_view(addr + offset, length, cqdma=cqdma))
+                    else:
+                        # Receive the data straight into the file's mapping.
+                        with dump.view(offset, length) as view:
+                            self.cmd_read32_into(addr + offset, view)
+                except ProtocolError:
+                    # The data may have been received before the status
+                    # that failed, so make the hole read back as zeros.
+                    dump.clear(offset, length)
+                    if holes and sum(holes[-1]) == addr + offset:
+                        holes[-1] = (holes[-1][0], holes[-1][1] + length)
+                    else:
+                        holes.append((addr + offset, length))
+                if progress:
+                    elapsed = max(time.perf_counter_ns() - start_ns, 1)
+                    progress(offset + length, count, (offset + length)*1000000000//elapsed)
+        end_ns = time.perf_counter_ns()
+
+        if print_speed:
+            elapsed = max(end_ns - start_ns, 1)
+            print("Dumped {} bytes in {:.6f} seconds ({} bytes per second).".format(count, elapsed/1000000000, count*1000000000//elapsed))
+
+        return holes
+
     def memory_write(self, addr, data, cqdma=False, print_speed=False):
         '''Write a byte array to a range of memory.
 
@@ -764,6 +1387,37 @@ class UsbDl:
             elapsed = end_ns - start_ns
             print("Wrote {} bytes in {:.6f} seconds ({} bytes per second).".format(len(data), elapsed/1000000000, len(data)*1000000000//elapsed))
 
+    def unlock_memory_access(self):
+        '''Prepare the BROM for dumping and loading memory.
+
+        This disables the WDT, disables caches, and, if the SoC supports it,
+        disables the BROM's memory bounds check.
+
+        Returns True if the CQDMA must be used to access restricted memory,
+        or False if the normal read32/write32 commands can be used.
+        '''
+        # Disable WDT.
+        self.cmd_write32(self.soc['toprgu'][0], [0x22000000])
+
+        try:
+            # The C8 B1 command disables caches.
+            self.cmd_C8('B1')
+        except:
+            pass
+
+        # Check if the bounds check method is available.
+        if not self.soc.get('brom_g_bounds_check', False):
+            # Assume we have to use the CQDMA to access restricted memory.
+            return True
+
+        # Disable bounds check.
+        for (addr, data) in self.soc['brom_g_bounds_check']:
+            self.cqdma_write32(addr, [data])
+        self.bounds_check_disabled = True
+
+        # We can use normal read32/write32 commands now.
+        return False
+
     def wdt_reset(self):
         self.cmd_write32(self.soc['toprgu'][0], [0x22000000 | 0x10 | 0x4])
         time.sleep(0.001)
@@ -772,11 +1426,23 @@ class UsbDl:
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument('port', type=str, help="The serial port you want to connect to.")
+    parser.add_argument('port', type=str, help="The serial port you want to connect to, \"usb\" to use libusb, or \"replay:FILE\" to play back a capture.")
+    parser.add_argument('-B', '--batch-echo', action='store_true', help="Send each command's header in one write and check its echo in one read.")
+    parser.add_argument('-t', '--trace', type=str, help="Record every command to this trace file and print a summary of where the time went. View the file with usbdl_trace.py.")
+    parser.add_argument('-C', '--capture', type=str, help="Record every byte sent and received to this capture file.")
     args = parser.parse_args()
 
+    tracer = None
+    if args.trace:
+        tracer = Tracer(args.trace)
+        # Close and summarize the trace however the run ends, since a run
+        # that fails is the one most worth looking at. These run in reverse
+        # order.
+        atexit.register(tracer.print_summary)
+        atexit.register(tracer.close)
+
     try:
-        usbdl = UsbDl(args.port, debug=False)
+        usbdl = UsbDl(args.port, debug=False, batch_echo=args.batch_echo, tracer=tracer, capture=args.capture)
     except DeviceResetException as e:
         print(e)
         sys.exit(0)
@@ -784,70 +1450,41 @@ if __name__ == "__main__":
     # Get the security configuration of the target.
     usbdl.cmd_get_target_config()
 
-    # Disable WDT.
-    print("Disabling WDT...")
-    usbdl.cmd_write32(usbdl.soc['toprgu'][0], [0x22000000])
+    # Disable the WDT and the BROM's memory restrictions.
+    print("Unlocking memory access...")
+    use_cqdma = usbdl.unlock_memory_access()
 
     # Dump efuses to file.
     print("Dumping efuses...")
-    efuses = usbdl.memory_read(usbdl.soc['efusec'][0], usbdl.soc['efusec'][1])
-    efuse_file = open("{}-efuses.bin".format(usbdl.soc['name'].lower()), 'wb')
-    efuse_file.write(efuses)
-    efuse_file.close()
+    print_holes(usbdl.memory_dump(usbdl.soc['efusec'][0], usbdl.soc['efusec'][1], "{}-efuses.bin".format(usbdl.soc['name'].lower())))
 
     # Print a string to UART0.
-    for byte in "Hello, there!\r\n".encode('utf-8'):
-        usbdl.cmd_write32(0x11002000, [byte])
-
-    try:
-        # The C8 B1 command disables caches.
-        usbdl.cmd_C8('B1')
-    except:
-        pass
-
-    # Assume we have to use the CQDMA to access restricted memory.
-    use_cqdma = True
-
-    # Check if the bounds check method is available.
-    if usbdl.soc.get('brom_g_bounds_check', False):
-        # Disable bounds check.
-        for (addr, data) in usbdl.soc['brom_g_bounds_check']:
-            usbdl.cqdma_write32(addr, [data])
-
-        # We can use normal read32/write32 commands now.
-        use_cqdma = False
+    with usbdl.batch() as batch:
+        for byte in "Hello, there!\r\n".encode('utf-8'):
+            batch.write32(0x11002000, [byte])
 
     # NOTE: Using the CQDMA method to dump a large (>4kB) chunk of memory,
     # like the entire BROM, will almost certainly fail and cause the CPU to
     # reset. To work around this, try dumping the memory in smaller chunks,
     # like 1kB, and saving them to disk, then reboot the SoC into BROM mode
     # again and dump the next chunk until you've dumped the memory you're
-    # interested in.
+    # interested in. usbdl_dump.py automates this.
 
     # Dump BROM.
     print("Dumping BROM...")
-    brom = usbdl.memory_read(usbdl.soc['brom'][0], usbdl.soc['brom'][1], cqdma=use_cqdma, print_speed=True)
-    if len(brom) != usbdl.soc['brom'][1]:
+    holes = usbdl.memory_dump(usbdl.soc['brom'][0], usbdl.soc['brom'][1], "{}-brom.bin".format(usbdl.soc['name'].lower()), cqdma=use_cqdma, print_speed=True)
+    if holes:
+        print_holes(holes)
         print("Error: Failed to dump entire BROM.")
         sys.exit(1)
 
-    brom_file = open("{}-brom.bin".format(usbdl.soc['name'].lower()), 'wb')
-    brom_file.write(brom)
-    brom_file.close()
-
     # Dump SRAM.
     print("Dumping SRAM...")
-    sram = usbdl.memory_read(usbdl.soc['sram'][0], usbdl.soc['sram'][1], cqdma=use_cqdma, print_speed=True)
-    sram_file = open("{}-sram.bin".format(usbdl.soc['name'].lower()), 'wb')
-    sram_file.write(sram)
-    sram_file.close()
+    print_holes(usbdl.memory_dump(usbdl.soc['sram'][0], usbdl.soc['sram'][1], "{}-sram.bin".format(usbdl.soc['name'].lower()), cqdma=use_cqdma, print_speed=True))
 
     # Dump L2 SRAM.
     print("Dumping L2 SRAM...")
-    l2_sram = usbdl.memory_read(usbdl.soc['l2_sram'][0], usbdl.soc['l2_sram'][1], cqdma=use_cqdma, print_speed=True)
-    l2_sram_file = open("{}-l2-sram.bin".format(usbdl.soc['name'].lower()), 'wb')
-    l2_sram_file.write(l2_sram)
-    l2_sram_file.close()
+    print_holes(usbdl.memory_dump(usbdl.soc['l2_sram'][0], usbdl.soc['l2_sram'][1], "{}-l2-sram.bin".format(usbdl.soc['name'].lower()), cqdma=use_cqdma, print_speed=True))
 
     # Code parameters.
     binary = open("demo/mode-switch/mode-switch.bin", 'rb').read()
@@ -874,3 +1511,4 @@ if __name__ == "__main__":
     if thumb_mode:
         load_addr |= 1
     usbdl.cmd_jump_da(load_addr)
+    usbdl.close()
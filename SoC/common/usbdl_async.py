@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# usbdl_async.py - An asyncio interface for communicating with SoCs over USB
+# Download Mode.
+# Copyright (C) 2019-2021  Forest Crossman <cyrozap@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import argparse
+import asyncio
+import collections
+import functools
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from usbdl import DeviceResetException, UsbDl, auto_int
+from usbdl_dump import REGIONS
+
+
+class AsyncUsbDl:
+    '''An asyncio wrapper around UsbDl.
+
+    Every public UsbDl method (cmd_*, memory_read, etc.) is available as a
+    coroutine with the same arguments. Each device gets its own worker thread
+    to do the blocking I/O in, so commands to one device run in the order
+    they were issued, while a single event loop can drive many devices at
+    once.
+    '''
+
+    def __init__(self, usbdl, executor):
+        self.usbdl = usbdl
+        self.executor = executor
+
+    @classmethod
+    async def open(cls, port, **kwargs):
+        '''Connect to a device. Takes the same arguments as UsbDl.'''
+        executor = ThreadPoolExecutor(max_workers=1)
+        loop = asyncio.get_running_loop()
+        try:
+            usbdl = await loop.run_in_executor(executor, functools.partial(UsbDl, port, **kwargs))
+        except:
+            executor.shutdown(wait=False)
+            raise
+
+        return cls(usbdl, executor)
+
+    def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def __getattr__(self, name):
+        attr = getattr(self.usbdl, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        async def method(*args, **kwargs):
+            return await self._run(attr, *args, **kwargs)
+        method.__name__ = name
+        method.__doc__ = attr.__doc__
+
+        return method
+
+    async def close(self):
+        await self._run(self.usbdl.close)
+        self.executor.shutdown()
+
+    async def memory_read_chunks(self, addr, count, chunk_size, cqdma=False, prefetch=1):
+        '''Read a range of memory a chunk at a time.
+
+        This is an async generator that yields (address, data) tuples. While
+        the caller is processing one chunk, the next prefetch chunks are
+        already being read from the device.
+
+        addr: A 32-bit address as an int.
+        count: The length of data to read, in bytes.
+        chunk_size: The number of bytes to read at a time.
+        prefetch: The number of chunks to read ahead.
+        '''
+        assert chunk_size > 0
+        assert chunk_size % 4 == 0
+
+        chunks = iter([(addr + offset, min(chunk_size, count - offset)) for offset in range(0, count, chunk_size)])
+        pending = collections.deque()
+
+        def submit():
+            chunk = next(chunks, None)
+            if chunk is not None:
+                (chunk_addr, chunk_count) = chunk
+                pending.append((chunk_addr, self._run(self.usbdl.memory_read, chunk_addr, chunk_count, cqdma=cqdma)))
+
+        for i in range(prefetch + 1):
+            submit()
+
+        try:
+            while pending:
+                (chunk_addr, future) = pending.popleft()
+                data = await future
+                submit()
+                yield (chunk_addr, data)
+        finally:
+            # Don't start any more reads if the caller stops early. A read
+            # that's already running can't be interrupted, but it finishes
+            # before any later command starts, since the device only has one
+            # worker thread.
+            for (chunk_addr, future) in pending:
+                future.cancel()
+
+
+async def dump_device(port, regions, chunk_size):
+    try:
+        usbdl = await AsyncUsbDl.open(port, debug=False)
+    except DeviceResetException as e:
+        print("{}: {}".format(port, e))
+        return
+
+    try:
+        use_cqdma = await usbdl.unlock_memory_access()
+        soc_name = usbdl.soc['name'].lower()
+
+        for region in regions:
+            (base, size) = usbdl.soc[region]
+            path = "{}-{}-{}.bin".format(soc_name, region.replace('_', '-'), os.path.basename(port))
+            print("{}: Dumping {} to {}...".format(port, region, path))
+            with open(path, 'wb') as dump_file:
+                async for (addr, data) in usbdl.memory_read_chunks(base, size, chunk_size, cqdma=use_cqdma):
+                    dump_file.write(data)
+    finally:
+        await usbdl.close()
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('ports', type=str, nargs='+', help="The serial ports of the devices you want to dump.")
+    parser.add_argument('-R', '--region', dest='regions', type=str, action='append', choices=REGIONS, help="A memory region you want to dump. Can be specified multiple times. Default: efusec")
+    parser.add_argument('-c', '--chunk-size', type=auto_int, default=0x1000, help="The number of bytes to read at a time. Default: 0x1000")
+    args = parser.parse_args()
+
+    results = await asyncio.gather(*[dump_device(port, args.regions or ['efusec'], args.chunk_size) for port in args.ports], return_exceptions=True)
+
+    failed = False
+    for port, result in zip(args.ports, results):
+        if isinstance(result, BaseException):
+            print("{}: Error: {!r}".format(port, result))
+            failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
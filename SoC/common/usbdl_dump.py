@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# usbdl_dump.py - A tool for dumping memory regions over USB Download Mode in
+# small, resumable chunks.
+# Copyright (C) 2019-2021  Forest Crossman <cyrozap@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import serial
+
+from transport import TransportError
+from usbdl import DeviceResetException, NotEnoughDataException, ProtocolError, UsbDl, auto_int
+
+
+REGIONS = (
+    'brom',
+    'sram',
+    'l2_sram',
+    'efusec',
+)
+
+DEFAULT_REGIONS = (
+    'brom',
+    'sram',
+    'l2_sram',
+)
+
+
+def merge_ranges(ranges):
+    '''Merge a list of (start, end) ranges into a sorted list of disjoint
+    ranges.
+    '''
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def range_done(ranges, start, end):
+    for done_start, done_end in ranges:
+        if done_start <= start and end <= done_end:
+            return True
+    return False
+
+
+class RegionDump:
+    '''A memory region being dumped to a file, along with a sidecar manifest
+    recording which parts of the file have already been dumped.
+    '''
+
+    def __init__(self, path, soc_name, name, base, size):
+        self.path = path
+        self.manifest_path = path + '.json'
+        self.soc_name = soc_name
+        self.name = name
+        self.base = base
+        self.size = size
+        self.done = []
+
+        if os.path.exists(self.manifest_path):
+            manifest = json.load(open(self.manifest_path, 'r'))
+            if (manifest['soc'], manifest['base'], manifest['size']) != (soc_name, base, size):
+                raise ValueError("Manifest {} does not match {} region 0x{:08x}+0x{:x}.".format(
+                    self.manifest_path, name, base, size))
+            self.done = merge_ranges(manifest['done'])
+
+        # Create the output file without allocating any space for it, so that
+        # chunks we haven't dumped yet are left as holes.
+        if not os.path.exists(self.path):
+            open(self.path, 'wb').close()
+            # Whatever the manifest says was dumped went with the old file.
+            self.done = []
+        self.file = open(self.path, 'r+b')
+        self.file.truncate(size)
+
+    def close(self):
+        self.file.close()
+
+    def complete(self):
+        return range_done(self.done, 0, self.size)
+
+    def pending(self, chunk_size):
+        '''Yield the (offset, length) of each chunk that hasn't been dumped.'''
+        for offset in range(0, self.size, chunk_size):
+            length = min(chunk_size, self.size - offset)
+            if not range_done(self.done, offset, offset + length):
+                yield (offset, length)
+
+    def write_chunk(self, offset, data):
+        self.file.seek(offset)
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+        self.done = merge_ranges(self.done + [[offset, offset + len(data)]])
+        self.save_manifest()
+
+    def save_manifest(self):
+        manifest = {
+            'soc': self.soc_name,
+            'region': self.name,
+            'base': self.base,
+            'size': self.size,
+            'done': self.done,
+        }
+        tmp_path = self.manifest_path + '.tmp'
+        tmp_file = open(tmp_path, 'w')
+        json.dump(manifest, tmp_file)
+        tmp_file.close()
+        os.replace(tmp_path, self.manifest_path)
+
+
+def dump_regions(usbdl, dumps, chunk_size, cqdma=None):
+    '''Dump every pending chunk of each region, writing each chunk to disk as
+    soon as it has been read.
+    '''
+    use_cqdma = usbdl.unlock_memory_access()
+    if cqdma is not None:
+        use_cqdma = cqdma
+
+    for dump in dumps:
+        for offset, length in dump.pending(chunk_size):
+            addr = dump.base + offset
+            print("Dumping {} 0x{:08x}-0x{:08x}...".format(dump.name, addr, addr + length - 1))
+            try:
+                data = usbdl.memory_read(addr, length, cqdma=use_cqdma)
+            except ProtocolError as e:
+                print("Error: Failed to read 0x{:08x}: {}".format(addr, e))
+                continue
+            dump.write_chunk(offset, data)
+
+def wait_for_port(port, timeout):
+    if port == "usb" or port.startswith("usb:"):
+        # There's no device node to wait for, so just give the device time to
+        # re-enumerate.
+        time.sleep(min(timeout, 3))
+        return True
+
+    end = time.monotonic() + timeout
+    while not os.path.exists(port):
+        if time.monotonic() > end:
+            return False
+        time.sleep(0.1)
+    return True
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('port', type=str, help="The serial port you want to connect to, or \"usb\" to use libusb.")
+    parser.add_argument('-R', '--region', dest='regions', type=str, action='append', choices=REGIONS, help="A memory region you want to dump. Can be specified multiple times. Default: brom, sram, and l2_sram")
+    parser.add_argument('-c', '--chunk-size', type=auto_int, default=0x400, help="The number of bytes to read at a time. Default: 0x400")
+    parser.add_argument('-o', '--output-dir', type=str, default=".", help="The directory to write the dumps to. Default: .")
+    parser.add_argument('-r', '--retries', type=int, default=100, help="The number of times to reconnect after the device resets. Default: 100")
+    parser.add_argument('-t', '--reconnect-timeout', type=float, default=60, help="How long to wait for the device to come back after a reset, in seconds. Default: 60")
+    parser.add_argument('-B', '--batch-echo', action='store_true', help="Send each command's header in one write and check its echo in one read.")
+    cqdma_group = parser.add_mutually_exclusive_group()
+    cqdma_group.add_argument('--cqdma', dest='cqdma', action='store_true', default=None, help="Always read memory using the CQDMA.")
+    cqdma_group.add_argument('--no-cqdma', dest='cqdma', action='store_false', help="Never read memory using the CQDMA.")
+    args = parser.parse_args()
+
+    assert args.chunk_size > 0
+    assert args.chunk_size % 4 == 0
+
+    dumps = None
+    attempt = 0
+    while True:
+        usbdl = None
+        try:
+            usbdl = UsbDl(args.port, debug=False, batch_echo=args.batch_echo)
+            if dumps is None:
+                dumps = []
+                for region in args.regions or DEFAULT_REGIONS:
+                    (base, size) = usbdl.soc[region]
+                    path = os.path.join(args.output_dir, "{}-{}.bin".format(usbdl.soc['name'].lower(), region.replace('_', '-')))
+                    dumps.append(RegionDump(path, usbdl.soc['name'], region, base, size))
+            dump_regions(usbdl, dumps, args.chunk_size, cqdma=args.cqdma)
+            usbdl.close()
+            break
+        except (DeviceResetException, NotEnoughDataException, TransportError, serial.SerialException) as e:
+            if usbdl:
+                usbdl.close()
+            print("Lost connection to device: {}".format(e if str(e) else type(e).__name__))
+            attempt += 1
+            if attempt > args.retries:
+                print("Error: Too many resets. Run this again to resume the dump.")
+                sys.exit(1)
+
+            # Give the device time to drop off the bus before waiting for it
+            # to come back.
+            time.sleep(1)
+            if not wait_for_port(args.port, args.reconnect_timeout):
+                print("Error: Timed out waiting for {} to come back. Run this again to resume the dump.".format(args.port))
+                sys.exit(1)
+
+    incomplete = False
+    for dump in dumps:
+        dump.close()
+        if dump.complete():
+            print("{} dumped to {}.".format(dump.name, dump.path))
+        else:
+            print("Error: {} is incomplete. Run this again to retry the missing chunks.".format(dump.name))
+            incomplete = True
+
+    if incomplete:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# usbdl_fleet.py - A tool for running the same USB Download Mode job on every
+# connected device at once.
+# Copyright (C) 2019-2021  Forest Crossman <cyrozap@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import argparse
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from serial.tools import list_ports
+
+from usbdl import UsbDl, auto_int
+from usbdl_dump import REGIONS, RegionDump, dump_regions
+
+
+# MediaTek BROM USB DL mode.
+BROM_VID = 0x0e8d
+BROM_PID = 0x0003
+
+
+def find_ports(vid=BROM_VID, pid=BROM_PID):
+    '''Return the serial ports of all the connected devices in BROM DL
+    mode.
+    '''
+    return sorted(port.device for port in list_ports.comports() if (port.vid, port.pid) == (vid, pid))
+
+def job_dump(usbdl, output_dir, args):
+    '''Dump memory regions. Returns the number of bytes dumped.'''
+    dumps = []
+    for region in args.regions or ('efusec', 'brom', 'sram'):
+        (base, size) = usbdl.soc[region]
+        path = os.path.join(output_dir, "{}-{}.bin".format(usbdl.soc['name'].lower(), region.replace('_', '-')))
+        dumps.append(RegionDump(path, usbdl.soc['name'], region, base, size))
+
+    dump_regions(usbdl, dumps, args.chunk_size)
+
+    byte_count = 0
+    for dump in dumps:
+        dump.close()
+        if not dump.complete():
+            raise RuntimeError("{} is incomplete.".format(dump.name))
+        byte_count += dump.size
+
+    return byte_count
+
+def job_load(usbdl, output_dir, args):
+    '''Load a payload and jump to it. Returns the number of bytes loaded.'''
+    use_cqdma = usbdl.unlock_memory_access()
+
+    binary = open(args.payload, 'rb').read()
+    usbdl.memory_write(args.load_address, binary, cqdma=use_cqdma, print_speed=True)
+
+    # Mark DA as verified.
+    if not usbdl.soc.get('brom_g_da_verified', False):
+        raise ValueError("No DA verification address specified for {}.".format(usbdl.soc['name']))
+    if use_cqdma:
+        usbdl.cqdma_write32(usbdl.soc['brom_g_da_verified'], [1])
+    else:
+        usbdl.cmd_write32(usbdl.soc['brom_g_da_verified'], [1])
+
+    print("Jumping to executable...")
+    load_addr = args.load_address
+    if args.thumb:
+        load_addr |= 1
+    usbdl.cmd_jump_da(load_addr)
+
+    return len(binary)
+
+JOBS = {
+    'dump': job_dump,
+    'load': job_load,
+}
+
+def run_device(port, args):
+    '''Run a job on one device, logging to a file in its own directory.
+
+    This runs in a worker process, so redirecting stdout only affects this
+    device.
+    '''
+    output_dir = os.path.join(args.output_dir, os.path.basename(port))
+    os.makedirs(output_dir, exist_ok=True)
+    sys.stdout = open(os.path.join(output_dir, "log.txt"), 'w', buffering=1)
+
+    result = {
+        'port': port,
+        'soc': None,
+        'version': None,
+        'bytes': 0,
+        'seconds': 0,
+        'error': None,
+    }
+
+    usbdl = None
+    start = time.perf_counter()
+    try:
+        usbdl = UsbDl(port, debug=False)
+        result['soc'] = usbdl.soc['name']
+        (hw_subcode, hw_ver, sw_ver) = usbdl.cmd_get_hw_sw_ver()
+        result['version'] = "{:04x}/{:04x}/{:04x}".format(hw_subcode, hw_ver, sw_ver)
+        print("{} HW subcode/HW ver/SW ver: {}".format(result['soc'], result['version']))
+
+        result['bytes'] = JOBS[args.job](usbdl, output_dir, args)
+    except Exception as e:
+        traceback.print_exc(file=sys.stdout)
+        result['error'] = "{}: {}".format(type(e).__name__, e)
+    finally:
+        if usbdl:
+            usbdl.close()
+    result['seconds'] = time.perf_counter() - start
+
+    sys.stdout.close()
+
+    return result
+
+def print_summary(results):
+    print("{:<16} {:<8} {:<16} {:>10} {:>9} {:>12}  {}".format("Port", "SoC", "Version", "Bytes", "Seconds", "Bytes/s", "Result"))
+    for result in results:
+        rate = int(result['bytes'] / result['seconds']) if result['seconds'] > 0 else 0
+        print("{:<16} {:<8} {:<16} {:>10} {:>9.3f} {:>12}  {}".format(
+            result['port'], result['soc'] or "?", result['version'] or "?", result['bytes'], result['seconds'], rate,
+            result['error'] or "OK"))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('job', type=str, choices=JOBS.keys(), help="The job to run on every device.")
+    parser.add_argument('-p', '--port', dest='ports', type=str, action='append', help="A serial port to run the job on. Can be specified multiple times. Default: every connected device in BROM DL mode")
+    parser.add_argument('-o', '--output-dir', type=str, default=".", help="The directory to write each device's logs and results to. Default: .")
+    parser.add_argument('-j', '--jobs', type=int, help="The number of devices to work on at once. Default: all of them")
+    parser.add_argument('-R', '--region', dest='regions', type=str, action='append', choices=REGIONS, help="dump: A memory region you want to dump. Can be specified multiple times. Default: efusec, brom, and sram")
+    parser.add_argument('-c', '--chunk-size', type=auto_int, default=0x400, help="dump: The number of bytes to read at a time. Default: 0x400")
+    parser.add_argument('-P', '--payload', type=str, default="demo/mode-switch/mode-switch.bin", help="load: The payload you want to load. Default: demo/mode-switch/mode-switch.bin")
+    parser.add_argument('-l', '--load-address', type=auto_int, default=0x00200000, help="load: The address you want to load the payload at. Default: 0x00200000")
+    parser.add_argument('-T', '--thumb', action='store_true', help="load: Jump to the payload in Thumb mode.")
+    args = parser.parse_args()
+
+    ports = args.ports or find_ports()
+    if not ports:
+        print("Error: No devices found.")
+        sys.exit(1)
+
+    print("Running \"{}\" on {} device(s): {}".format(args.job, len(ports), ", ".join(ports)))
+
+    with ProcessPoolExecutor(max_workers=args.jobs or len(ports)) as executor:
+        results = list(executor.map(run_device, ports, [args] * len(ports)))
+
+    print_summary(results)
+
+    if any(result['error'] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# usbdl_trace.py - Per-command tracing and latency histograms for UsbDl.
+# Copyright (C) 2019-2021  Forest Crossman <cyrozap@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import argparse
+import functools
+import math
+import struct
+import time
+
+
+# Trace file format: TRACE_MAGIC, followed by records that each start with a
+# one-byte type. A name record assigns an ID to a span name the first time
+# it's used, and a span record describes one finished span. All times are in
+# nanoseconds, and span start times are relative to when the trace started.
+TRACE_MAGIC = b'USBDLTR\x01'
+RECORD_NAME = 0
+RECORD_SPAN = 1
+NAME_RECORD = struct.Struct('<BHB')
+SPAN_RECORD = struct.Struct('<BHBQQQII')
+
+# UsbDl's internal helpers, and the names their spans are recorded under.
+PHASES = {
+    '_send_fields': 'echo',
+    # Mostly status words, but also the values some commands return, like
+    # the HW code.
+    'get_word': 'word',
+    '_recv_into': 'data',
+    '_send_payload': 'payload',
+    '_cqdma_transfer': 'cqdma_transfer',
+}
+
+# Higher-level UsbDl methods that are traced under their own names, along
+# with every cmd_* and scmd_* method.
+OPERATIONS = (
+    'memory_read',
+    'memory_write',
+    'cqdma_read32',
+    'cqdma_write32',
+)
+
+
+class LatencyHistogram:
+    '''A log-linear histogram of nanosecond latencies, in the style of
+    HdrHistogram.
+
+    Values are counted in buckets whose width is proportional to their
+    magnitude, so any value is recorded to within 1/2**(sub_bucket_bits-1)
+    of its true value, using a fixed amount of memory no matter how many
+    values are recorded.
+    '''
+
+    def __init__(self, sub_bucket_bits=6):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        shift = value.bit_length() - self.sub_bucket_bits
+        if shift <= 0:
+            return value
+        half = 1 << (self.sub_bucket_bits - 1)
+        return (1 << self.sub_bucket_bits) + (shift - 1) * half + (value >> shift) - half
+
+    def _highest_equivalent(self, index):
+        if index < (1 << self.sub_bucket_bits):
+            return index
+        half = 1 << (self.sub_bucket_bits - 1)
+        (shift, sub_bucket) = divmod(index - (1 << self.sub_bucket_bits), half)
+        shift += 1
+        return ((sub_bucket + half + 1) << shift) - 1
+
+    def record(self, value):
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, pct):
+        '''Return the value that pct percent of the recorded values are less
+        than or equal to.
+        '''
+        if not self.count:
+            return 0
+        target = max(1, math.ceil(pct / 100 * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._highest_equivalent(index), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+
+class SpanStats:
+    '''Totals and latency histograms for every span with the same name.'''
+
+    def __init__(self):
+        self.wall = LatencyHistogram()
+        self.transport_ns = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+    def add(self, wall_ns, transport_ns, bytes_out, bytes_in):
+        self.wall.record(wall_ns)
+        self.transport_ns += transport_ns
+        self.bytes_out += bytes_out
+        self.bytes_in += bytes_in
+
+
+class TracingTransport:
+    '''Wraps a transport and charges the time and bytes of each transfer to
+    the tracer's open spans.
+    '''
+
+    def __init__(self, transport, tracer):
+        self.transport = transport
+        self.tracer = tracer
+
+    def __getattr__(self, name):
+        return getattr(self.transport, name)
+
+    def close(self):
+        self.transport.close()
+
+    def write(self, data):
+        start_ns = time.perf_counter_ns()
+        count = self.transport.write(data)
+        self.tracer._account(time.perf_counter_ns() - start_ns, len(data), 0)
+        return count
+
+    def read(self, count):
+        start_ns = time.perf_counter_ns()
+        data = self.transport.read(count)
+        self.tracer._account(time.perf_counter_ns() - start_ns, 0, len(data))
+        return data
+
+    def readinto(self, buf):
+        start_ns = time.perf_counter_ns()
+        count = self.transport.readinto(buf)
+        self.tracer._account(time.perf_counter_ns() - start_ns, 0, count or 0)
+        return count
+
+
+class Tracer:
+    '''Records a span for each command UsbDl sends and each phase of it
+    (echo checks, 16-bit words, data, payloads, and CQDMA transfers), with
+    its wall time, the time spent in the transport, and the number of bytes
+    sent and received.
+
+    Attach a tracer with UsbDl.set_tracer(). Tracing works by wrapping the
+    methods of that UsbDl instance, so an instance without a tracer runs the
+    same code it would if this module didn't exist.
+
+    Spans nest, so a cmd_read32 span includes the echo, word, and data
+    spans inside it, and transport time is charged to every open span.
+
+    path: An optional file to write every span to, for viewing later with
+          this module's command-line interface.
+    '''
+
+    def __init__(self, path=None):
+        self.stats = {}
+        self.stack = []
+        self.names = {}
+        self.trace_file = None
+        self.start_ns = time.perf_counter_ns()
+        if path is not None:
+            self.trace_file = open(path, 'wb')
+            self.trace_file.write(TRACE_MAGIC)
+
+    def close(self):
+        if self.trace_file is not None:
+            self.trace_file.close()
+            self.trace_file = None
+
+    def _wrap(self, name, func):
+        @functools.wraps(func)
+        def traced(*args, **kwargs):
+            span = [name, time.perf_counter_ns(), 0, 0, 0]
+            self.stack.append(span)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.stack.pop()
+                self._finish(span, time.perf_counter_ns())
+        return traced
+
+    def attach(self, usbdl):
+        '''Start tracing a UsbDl instance.'''
+        for (method, name) in self._traced_methods(usbdl):
+            setattr(usbdl, method, self._wrap(name, getattr(usbdl, method)))
+        usbdl.ser = TracingTransport(usbdl.ser, self)
+
+    def detach(self, usbdl):
+        '''Stop tracing a UsbDl instance.'''
+        for (method, name) in self._traced_methods(usbdl):
+            usbdl.__dict__.pop(method, None)
+        if isinstance(usbdl.ser, TracingTransport):
+            usbdl.ser = usbdl.ser.transport
+
+    def _traced_methods(self, usbdl):
+        methods = list(PHASES.items())
+        for method in dir(type(usbdl)):
+            if method.startswith(('cmd_', 'scmd_')) or method in OPERATIONS:
+                methods.append((method, method))
+        return methods
+
+    def _account(self, transport_ns, bytes_out, bytes_in):
+        for span in self.stack:
+            span[2] += transport_ns
+            span[3] += bytes_out
+            span[4] += bytes_in
+
+    def _finish(self, span, end_ns):
+        (name, start_ns, transport_ns, bytes_out, bytes_in) = span
+        wall_ns = end_ns - start_ns
+
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = SpanStats()
+        stats.add(wall_ns, transport_ns, bytes_out, bytes_in)
+
+        if self.trace_file is not None:
+            name_id = self.names.get(name)
+            if name_id is None:
+                name_id = self.names[name] = len(self.names)
+                encoded = name.encode('utf-8')
+                self.trace_file.write(NAME_RECORD.pack(RECORD_NAME, name_id, len(encoded)) + encoded)
+            self.trace_file.write(SPAN_RECORD.pack(RECORD_SPAN, name_id, len(self.stack),
+                start_ns - self.start_ns, wall_ns, transport_ns, bytes_out, bytes_in))
+
+    def print_summary(self):
+        print_summary(self.stats)
+
+
+def read_trace(path):
+    '''Yield (name, depth, start_ns, wall_ns, transport_ns, bytes_out,
+    bytes_in) tuples for each span in a trace file, in the order the spans
+    finished.
+    '''
+    trace_file = open(path, 'rb')
+    if trace_file.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+        raise ValueError("{} is not a UsbDl trace file.".format(path))
+
+    names = {}
+    while True:
+        record_type = trace_file.read(1)
+        if not record_type:
+            break
+        if record_type[0] == RECORD_NAME:
+            (_, name_id, length) = NAME_RECORD.unpack(record_type + trace_file.read(NAME_RECORD.size - 1))
+            names[name_id] = trace_file.read(length).decode('utf-8')
+        elif record_type[0] == RECORD_SPAN:
+            (_, name_id, *fields) = SPAN_RECORD.unpack(record_type + trace_file.read(SPAN_RECORD.size - 1))
+            yield (names[name_id], *fields)
+        else:
+            raise ValueError("Unknown record type {} in {}.".format(record_type[0], path))
+
+    trace_file.close()
+
+def print_summary(stats):
+    print("{:<24} {:>8} {:>11} {:>11} {:>10} {:>10} {:>9} {:>9} {:>9} {:>9}".format(
+        "Span", "Count", "Wall ms", "Xport ms", "Bytes out", "Bytes in", "p50 us", "p90 us", "p99 us", "Max us"))
+    for (name, span) in sorted(stats.items(), key=lambda item: item[1].wall.total, reverse=True):
+        print("{:<24} {:>8} {:>11.3f} {:>11.3f} {:>10} {:>10} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+            name, span.wall.count, span.wall.total/1000000, span.transport_ns/1000000, span.bytes_out, span.bytes_in,
+            span.wall.percentile(50)/1000, span.wall.percentile(90)/1000, span.wall.percentile(99)/1000, span.wall.max/1000))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('trace', type=str, help="The trace file to view.")
+    parser.add_argument('-e', '--events', action='store_true', help="Print every span in the order they started, instead of a summary.")
+    args = parser.parse_args()
+
+    if args.events:
+        spans = sorted(read_trace(args.trace), key=lambda span: (span[2], span[1]))
+        for (name, depth, start_ns, wall_ns, transport_ns, bytes_out, bytes_in) in spans:
+            print("{:>14.6f} {}{} {:.1f} us ({:.1f} us in transport), {} out, {} in".format(
+                start_ns/1000000000, "  " * depth, name, wall_ns/1000, transport_ns/1000, bytes_out, bytes_in))
+        return
+
+    stats = {}
+    for (name, depth, start_ns, wall_ns, transport_ns, bytes_out, bytes_in) in read_trace(args.trace):
+        if name not in stats:
+            stats[name] = SpanStats()
+        stats[name].add(wall_ns, transport_ns, bytes_out, bytes_in)
+    print_summary(stats)
+
+
+if __name__ == "__main__":
+    main()